@@ -2,14 +2,22 @@
 
 import logging
 import os
-import tempfile
+import sys
 
 from llm_eval_test.parser import setup_parser
 
 logger = logging.getLogger("llm-eval-test")
 
 
-def config_env(offline_mode: bool = True, unitxt_catalog: str | None = None):
+def config_env(
+    offline_mode: bool = True,
+    unitxt_catalog: str | None = None,
+    datasets_dir: str | None = None,
+    cache_dir: str | None = None,
+    cache_size: int = 0,
+    shuffle_seed: int | None = None,
+    preprocess_jobs: int | None = None,
+):
     """Setup environment."""
 
     # Unitxt need to set this to run certain benchmarks
@@ -28,6 +36,23 @@ def config_env(offline_mode: bool = True, unitxt_catalog: str | None = None):
         # default catalog cards may overwrite local cards
         os.environ["UNITXT_ARTIFACTORIES"] = unitxt_catalog
 
+    if datasets_dir:
+        # Unitxt loaders resolve dataset repositories relative to this path
+        os.environ["UNITXT_HF_OFFLINE_DATASETS_PATH"] = datasets_dir
+
+    if cache_dir:
+        # Read by the task utils and tasks when caching preprocessed datasets and prompts
+        os.environ["LLM_EVAL_TEST_CACHE_DIR"] = cache_dir
+        os.environ["LLM_EVAL_TEST_CACHE_SIZE"] = str(cache_size)
+
+    if shuffle_seed is not None:
+        # Read by the task utils that shuffle answer choices
+        os.environ["LLM_EVAL_TEST_SHUFFLE_SEED"] = str(shuffle_seed)
+
+    if preprocess_jobs is not None:
+        # Read by the task utils as num_proc for dataset.map
+        os.environ["LLM_EVAL_TEST_MAP_PROC"] = str(preprocess_jobs)
+
 
 def eval_cli():
     local_dir = os.path.dirname(__file__)
@@ -44,44 +69,38 @@ def eval_cli():
     logger.info("CLI called with " + str(vars(args)))
 
     if args.offline is None:
-        if args.command == "download":
+        if args.command == "download" or getattr(args, "fetch_missing", False):
             args.offline = False
         else:
             args.offline = True
 
-    config_env(offline_mode=args.offline, unitxt_catalog=args.catalog_path)
-
-    # Late import to avoid slow cli
-    from llm_eval_test.lm_eval_wrapper import LMEvalWrapper
+    config_env(
+        offline_mode=args.offline,
+        unitxt_catalog=args.catalog_path,
+        datasets_dir=args.datasets if args.command == "run" else None,
+        cache_dir=getattr(args, "cache_dir", None),
+        cache_size=getattr(args, "cache_size", 0),
+        shuffle_seed=getattr(args, "shuffle_seed", None),
+        preprocess_jobs=getattr(args, "preprocess_jobs", None),
+    )
 
     if args.command == "list":
+        # Late import to avoid slow cli
+        from llm_eval_test.lm_eval_wrapper import LMEvalWrapper
+
         LMEvalWrapper.list_tasks(args.tasks_path)
     elif args.command == "run":
+        from llm_eval_test.lm_eval_wrapper import LMEvalWrapper
+
         if "chat/completions" in args.endpoint.lower():
             logger.warning("The /v1/chat/completions API is unsupported, please use /v1/completions")
 
-        # HACK: Working from a temporary directory allows us to load hf datasets
-        # from disk because the dataset and evaluate libraries search the local
-        # path first. Since Unitxt is loaded as a dataset, we also provide wrappers
-        # that point to the local python package.
-        with tempfile.TemporaryDirectory() as tmpdir:
-            os.chdir(tmpdir)
-            logger.info(f"Changing working directory to {tmpdir}")
-
-            # Symlink unitxt wrappers to working directory
-            for dataset in os.listdir(f"{local_dir}/wrappers"):
-                os.symlink(f"{local_dir}/wrappers/{dataset}", f"{tmpdir}/{dataset}")
-
-            # Symlink datasets to working directory
-            for dataset in os.listdir(args.datasets):
-                try:
-                    os.symlink(f"{args.datasets}/{dataset}", f"{tmpdir}/{dataset}")
-                except FileExistsError:
-                    logger.warning(f"Dataset '{dataset}' conflicts with existing wrapper, skipping")
-
-            # Call wrapped lm-eval
-            args.tasks = args.tasks.split(",")
-            LMEvalWrapper.exec(**vars(args))
+        # Call wrapped lm-eval
+        args.tasks = args.tasks.split(",")
+        failed = LMEvalWrapper.exec(**vars(args))
+        if failed:
+            logger.error(f"Failed to download datasets for: {list(failed)}")
+            sys.exit(1)
     elif args.command == "download":
         from llm_eval_test.downloader import download_datasets
 
@@ -91,8 +110,55 @@ def eval_cli():
             else [t.strip(" ").lower() for t in args.tasks.split(",")]
         )
         force_download = args.force_download
-        datasets = download_datasets(args.datasets, tasks, args.tasks_path, force_download)
+        datasets, failed = download_datasets(
+            args.datasets,
+            tasks,
+            args.tasks_path,
+            force_download,
+            args.jobs,
+            args.full,
+            args.pack,
+            args.retry,
+            args.hub_cache,
+        )
         logger.info(f"Downloaded datasets: {datasets}")
+        if failed:
+            logger.error(f"Failed to download datasets for: {list(failed)}")
+            sys.exit(1)
+
+        if args.bundle:
+            from llm_eval_test.bundle import write_bundle
+
+            write_bundle(args.datasets, args.bundle, args.tokenizer)
+    elif args.command == "import-bundle":
+        from llm_eval_test.bundle import import_bundle
+
+        problems = import_bundle(args.bundle, args.datasets, args.jobs)
+        if problems:
+            logger.error(f"Bundle {args.bundle} does not match its manifest:")
+            for problem in problems:
+                logger.error(f"  {problem}")
+            sys.exit(1)
+        logger.info(f"Imported {args.bundle} into {args.datasets}")
+    elif args.command == "verify":
+        from llm_eval_test.manifest import Manifest
+
+        manifest = Manifest(args.datasets)
+        if not manifest.repos:
+            logger.error(f"No datasets recorded in {manifest.path}")
+            sys.exit(1)
+
+        problems = manifest.verify(args.jobs, args.rehash)
+        manifest.save()
+        for dataset_repo in manifest.repos:
+            if dataset_repo in problems:
+                logger.error(f"{dataset_repo}: {len(problems[dataset_repo])} problem(s)")
+                for problem in problems[dataset_repo]:
+                    logger.error(f"  {problem}")
+            else:
+                logger.info(f"{dataset_repo}: ok")
+        if problems:
+            sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -2,24 +2,30 @@ import re
 
 import datasets
 
+from llm_eval_test.cache import cached_process_docs, map_num_proc
+
+BRACKETS_RE = re.compile("\\[.*?\\]")
+
 
 def preprocess(text):
     text = text.strip()
     # NOTE: Brackets are artifacts of the WikiHow dataset portion of HellaSwag.
     text = text.replace(" [title]", ". ")
-    text = re.sub("\\[.*?\\]", "", text)
+    text = BRACKETS_RE.sub("", text)
     text = text.replace("  ", " ")
     return text
 
 
+@cached_process_docs
 def process_docs(dataset: datasets.Dataset) -> datasets.Dataset:
-    def _process_doc(doc):
-        ctx = doc["ctx_a"] + " " + doc["ctx_b"].capitalize()
-        out_doc = {
-            "query": preprocess(doc["activity_label"] + ": " + ctx),
-            "choices": [preprocess(ending) for ending in doc["endings"]],
-            "gold": int(doc["label"]),
+    def _process_docs(docs):
+        return {
+            "query": [
+                preprocess(activity_label + ": " + ctx_a + " " + ctx_b.capitalize())
+                for activity_label, ctx_a, ctx_b in zip(docs["activity_label"], docs["ctx_a"], docs["ctx_b"], strict=True)
+            ],
+            "choices": [[preprocess(ending) for ending in endings] for endings in docs["endings"]],
+            "gold": [int(label) for label in docs["label"]],
         }
-        return out_doc
 
-    return dataset.map(_process_doc)
+    return dataset.map(_process_docs, batched=True, num_proc=map_num_proc())
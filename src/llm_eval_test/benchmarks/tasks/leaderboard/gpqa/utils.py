@@ -1,38 +1,52 @@
+import hashlib
+import os
 import random
 import re
 
 import datasets
 
+from llm_eval_test.cache import SHUFFLE_SEED_ENV, cached_process_docs, map_num_proc
+
+BRACKETS_RE = re.compile("\\[.*?\\]")
+
 
 def preprocess(text):
     if text is None:
         return " "
     text = text.strip()
     text = text.replace(" [title]", ". ")
-    text = re.sub("\\[.*?\\]", "", text)
+    text = BRACKETS_RE.sub("", text)
     text = text.replace("  ", " ")
     return text
 
 
+def doc_rng(question: str, seed: str) -> random.Random:
+    """Random generator seeded from the question, so a document is shuffled the same way every run."""
+    digest = hashlib.sha256(f"{seed}:{question}".encode()).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+@cached_process_docs(env=(SHUFFLE_SEED_ENV,))
 def process_docs(dataset: datasets.Dataset) -> datasets.Dataset:
-    def _process_doc(doc):
-        choices = [
-            preprocess(doc["Incorrect Answer 1"]),
-            preprocess(doc["Incorrect Answer 2"]),
-            preprocess(doc["Incorrect Answer 3"]),
-            preprocess(doc["Correct Answer"]),
-        ]
-
-        random.shuffle(choices)
-        correct_answer_index = choices.index(preprocess(doc["Correct Answer"]))
-
-        out_doc = {
-            "choice1": choices[0],
-            "choice2": choices[1],
-            "choice3": choices[2],
-            "choice4": choices[3],
-            "answer": f"({chr(65 + correct_answer_index)})",
-        }
-        return out_doc
-
-    return dataset.map(_process_doc)
+    seed = os.getenv(SHUFFLE_SEED_ENV, "0")
+
+    def _process_docs(docs):
+        out_docs = {"choice1": [], "choice2": [], "choice3": [], "choice4": [], "answer": []}
+        for i, question in enumerate(docs["Question"]):
+            correct_answer = preprocess(docs["Correct Answer"][i])
+            choices = [
+                preprocess(docs["Incorrect Answer 1"][i]),
+                preprocess(docs["Incorrect Answer 2"][i]),
+                preprocess(docs["Incorrect Answer 3"][i]),
+                correct_answer,
+            ]
+
+            doc_rng(question, seed).shuffle(choices)
+            correct_answer_index = choices.index(correct_answer)
+
+            for j, choice in enumerate(choices):
+                out_docs[f"choice{j + 1}"].append(choice)
+            out_docs["answer"].append(f"({chr(65 + correct_answer_index)})")
+        return out_docs
+
+    return dataset.map(_process_docs, batched=True, num_proc=map_num_proc())
@@ -1,12 +1,18 @@
+import cmath
+import functools
 import logging
+import random
+from fractions import Fraction
 from typing import Dict, List
 
 import datasets
 
+from llm_eval_test.cache import cached_process_docs
+from llm_eval_test.scoring import SCORING_STATS_KEY, SandboxedFunction, batched_process_results
+
 
 try:
     import re
-    import signal
 
     import sympy
     from math_verify import LatexExtractionConfig, parse, verify
@@ -20,6 +26,27 @@ please install via pip install lm-eval[math] or pip install -e .[math]",
 
 INVALID_ANSWER = "[invalidanswer]"
 
+# Wall-clock seconds a single equivalence check may take
+IS_EQUIV_TIMEOUT = 1.0
+IS_EQUIV_CACHE_SIZE = 2**16
+IS_EQUIV_SANDBOX = None
+# Numeric checks have their own deadline, so they don't eat into the one of simplify
+NUMERIC_TIMEOUT = 0.5
+NUMERIC_SANDBOX = None
+GOLD_CACHE_SIZE = 2**12
+
+# Tiers of check_equiv, from cheapest to most expensive
+EQUIV_TIERS = ("exact", "rational", "numeric", "simplify", "unparsed", "timeout")
+# Reported per task, with checks answered from the check_equiv cache
+EQUIV_REPORT = ("cached", *EQUIV_TIERS)
+# Integers and \frac{a}{b} or a/b fractions of integers
+RATIONAL_RE = re.compile(r"(?P<sign>-)?(?:\\frac\{(?P<fnum>-?\d+)\}\{(?P<fden>-?\d+)\}|(?P<num>\d+)(?:/(?P<den>\d+))?)")
+# Expressions numeric evaluation may get stuck on, left to simplify
+SLOW_EVAL_TYPES = (sympy.Integral, sympy.Sum, sympy.Product, sympy.Limit, sympy.Derivative)
+NUMERIC_SAMPLES = 3
+NUMERIC_PRECISION = 30
+NUMERIC_TOLERANCE = 1e-12
+
 
 # taken from
 # https://github.com/wellecks/lm-evaluation-harness/blob/master/lm_eval/tasks/minerva_math.py
@@ -27,6 +54,7 @@ def doc_to_text(doc: dict) -> str:
     return "Problem:" + "\n" + doc["problem"] + "\n\n" + "Solution:"
 
 
+@cached_process_docs
 def process_docs(dataset: datasets.Dataset) -> datasets.Dataset:
     def _process_doc(doc: dict) -> dict:
         out_doc = {
@@ -34,6 +62,8 @@ def process_docs(dataset: datasets.Dataset) -> datasets.Dataset:
             "solution": doc["solution"],
             "answer": remove_boxed(last_boxed_only_string(doc["solution"])),
         }
+        # Normalized once here rather than for every response
+        out_doc["normalized_answer"] = normalize_final_answer(out_doc["answer"])
         if getattr(doc, "few_shot", None) is not None:
             out_doc["few_shot"] = True
         return out_doc
@@ -70,35 +100,60 @@ def list_fewshot_samples() -> list[dict]:
     ]
 
 
-def process_results(doc: dict, results: List[str]) -> Dict[str, int]:
-    candidates = results[0]
-    parsed_candidate = parse(candidates)
-    parsed_answer = parse(doc["solution"], extraction_config=[LatexExtractionConfig()])
-    if verify(parsed_answer, parsed_candidate):
-        retval = 1
-    else:
-        retval = 0
+@batched_process_results
+def process_results(docs: List[dict], results: List[List[str]]) -> List[Dict[str, int]]:
+    outputs = []
+    for doc, doc_results in zip(docs, results):
+        tiers = dict.fromkeys(EQUIV_REPORT, 0)
+        candidates = doc_results[0]
+        parsed_candidate = parse(candidates)
+        parsed_answer = parse_gold(doc["solution"])
+        if verify(parsed_answer, parsed_candidate):
+            retval = 1
+        else:
+            retval = 0
+
+        try:
+            original = process_result_v1(doc, candidates, tiers)
+        except:  # noqa: E722
+            original = 0
+
+        output = {
+            "exact_match": retval,
+            "exact_match_original": original,
+            # Logged once per task by the harness
+            SCORING_STATS_KEY: tiers,
+        }
+        outputs.append(output)
 
-    try:
-        original = process_result_v1(doc, candidates)
-    except:  # noqa: E722
-        original = 0
+    return outputs
 
-    output = {
-        "exact_match": retval,
-        "exact_match_original": original,
-    }
-    return output
 
+@functools.lru_cache(maxsize=GOLD_CACHE_SIZE)
+def parse_gold(solution: str) -> list:
+    """
+    math_verify parse of a reference solution, the same for every response to a doc
+
+    Parses are sympy objects that can't be stored by process_docs, so they're memoized instead.
+    """
+    return parse(solution, extraction_config=[LatexExtractionConfig()])
 
-def process_result_v1(doc: dict, candidates: str) -> int:
+
+def process_result_v1(doc: dict, candidates: str, tiers: dict[str, int] | None = None) -> int:
     # using the orginal answer extraction method
     unnormalized_answer = get_unnormalized_answer(candidates)
     answer = normalize_final_answer(unnormalized_answer)
-    normalized_gold = normalize_final_answer(doc["answer"])
+    normalized_gold = doc.get("normalized_answer")
+    if normalized_gold is None:
+        normalized_gold = normalize_final_answer(doc["answer"])
     if answer == INVALID_ANSWER:
         return 0
-    if answer.strip() == normalized_gold.strip() or is_equiv(answer, normalized_gold):
+    hits = check_equiv.cache_info().hits
+    equiv, tier = check_equiv(answer, normalized_gold)
+    if tiers is not None:
+        # Memoized checks cost nothing whichever tier first decided them
+        tiers["cached" if check_equiv.cache_info().hits > hits else tier] += 1
+    if equiv:
         retval = 1
     else:
         retval = 0
@@ -151,64 +206,132 @@ def remove_boxed(s: str) -> str:
         return INVALID_ANSWER
 
 
-class timeout:
-    def __init__(self, seconds=1, error_message="Timeout"):
-        self.seconds = seconds
-        self.error_message = error_message
+def rational_value(x: str) -> Fraction | None:
+    """
+    Exact value of a normalized answer that is an integer or a fraction of integers, else None
+    """
+    match = RATIONAL_RE.fullmatch(x.strip())
+    if match is None:
+        return None
+    numerator = match.group("fnum") or match.group("num")
+    denominator = match.group("fden") or match.group("den")
+    try:
+        value = Fraction(int(numerator), int(denominator)) if denominator else Fraction(int(numerator))
+    except ZeroDivisionError:
+        return None
+    return -value if match.group("sign") else value
 
-    def handle_timeout(self, signum, frame):
-        raise TimeoutError(self.error_message)
 
-    def __enter__(self):
-        signal.signal(signal.SIGALRM, self.handle_timeout)
-        signal.alarm(self.seconds)
+def is_equiv(x1: str, x2: str) -> bool:
+    """
+    x1 and x2 are normalized latex string
+    """
+    return check_equiv(x1, x2)[0]
 
-    def __exit__(self, type, value, traceback):
-        signal.alarm(0)
 
+@functools.lru_cache(maxsize=IS_EQUIV_CACHE_SIZE)
+def check_equiv(x1: str, x2: str) -> tuple[bool, str]:
+    """
+    Tiered is_equiv, returning the result and the tier of EQUIV_TIERS that decided it
 
-def is_equiv(x1: str, x2: str) -> bool:
+    Exact and rational matches are decided here. Otherwise a difference that is nonzero at a
+    sample point rules out equivalence, before falling back to sympy.simplify. Both run in separate
+    processes that are killed and replaced when they overrun NUMERIC_TIMEOUT and IS_EQUIV_TIMEOUT.
+    Answers repeat across samples so results are memoized.
     """
-    x1 and x2 are normalized latex string
+    if x1.strip() == x2.strip():
+        return True, "exact"
+
+    r1, r2 = rational_value(x1), rational_value(x2)
+    if r1 is not None and r2 is not None:
+        # What simplify finds for integers and fractions, without parsing
+        return r1 == r2, "rational"
+
+    global IS_EQUIV_SANDBOX, NUMERIC_SANDBOX
+    if NUMERIC_SANDBOX is None:
+        NUMERIC_SANDBOX = SandboxedFunction(_differs, NUMERIC_TIMEOUT, default=False, warmup_args=("1", "1"))
+    if NUMERIC_SANDBOX(x1, x2):
+        return False, "numeric"
+
+    if IS_EQUIV_SANDBOX is None:
+        IS_EQUIV_SANDBOX = SandboxedFunction(
+            _is_equiv, IS_EQUIV_TIMEOUT, default=(False, "timeout"), warmup_args=("1", "1")
+        )
+    return IS_EQUIV_SANDBOX(x1, x2)
+
+
+def differs_numerically(x1, x2, diff) -> bool:
     """
-    eval_logger = logging.getLogger(__name__)
+    Whether diff = x1 - x2 is clearly nonzero at some sample point, in which case
+    sympy.simplify can't reduce it to 0. False means undecided.
+    """
+    if diff.has(*SLOW_EVAL_TYPES):
+        return False
+
+    rng = random.Random(0)
+    symbols = sorted(diff.free_symbols, key=str)
+    for _ in range(NUMERIC_SAMPLES):
+        point = {symbol: sympy.Rational(rng.randint(1, 97), rng.randint(1, 97)) for symbol in symbols}
+        try:
+            values = [complex(expr.evalf(NUMERIC_PRECISION, subs=point)) for expr in (diff, x1, x2)]
+        except (TypeError, ValueError, ZeroDivisionError, OverflowError):
+            continue
+        if not all(cmath.isfinite(value) for value in values):
+            # Undefined at this point
+            continue
+        scale = max(1.0, abs(values[1]), abs(values[2]))
+        if abs(values[0]) > NUMERIC_TOLERANCE * scale:
+            return True
+    return False
+
+
+def _differs(x1: str, x2: str) -> bool:
     try:
-        with timeout(seconds=1):
-            try:
-                parsed_x1 = parse_latex(x1)
-                parsed_x2 = parse_latex(x2)
-            except (
-                sympy.parsing.latex.errors.LaTeXParsingError,
-                sympy.SympifyError,
-                TypeError,
-            ):
-                eval_logger.debug(f"couldn't parse one of {x1} or {x2}")
-                return False
-
-            try:
-                diff = parsed_x1 - parsed_x2
-            except TypeError:
-                eval_logger.debug(f"couldn't subtract {x1} and {x2}")
-                return False
-
-            try:
-                if sympy.simplify(diff) == 0:
-                    return True
-                else:
-                    return False
-            except ValueError:
-                eval_logger.debug(
-                    f"Had some trouble simplifying when comparing {x1} and {x2}"
-                )
-    except TimeoutError:
-        eval_logger.debug(f"Timed out comparing {x1} and {x2}")
+        parsed_x1 = parse_latex(x1)
+        parsed_x2 = parse_latex(x2)
+        return differs_numerically(parsed_x1, parsed_x2, parsed_x1 - parsed_x2)
+    except ImportError:
+        raise
+    except Exception as e:
+        # Left to _is_equiv, which reports parse failures
+        logging.getLogger(__name__).debug(f"Couldn't evaluate {x1} and {x2} numerically with {e}")
         return False
+
+
+def _is_equiv(x1: str, x2: str) -> tuple[bool, str]:
+    eval_logger = logging.getLogger(__name__)
+    try:
+        try:
+            parsed_x1 = parse_latex(x1)
+            parsed_x2 = parse_latex(x2)
+        except (
+            sympy.parsing.latex.errors.LaTeXParsingError,
+            sympy.SympifyError,
+            TypeError,
+        ):
+            eval_logger.debug(f"couldn't parse one of {x1} or {x2}")
+            return False, "unparsed"
+
+        try:
+            diff = parsed_x1 - parsed_x2
+        except TypeError:
+            eval_logger.debug(f"couldn't subtract {x1} and {x2}")
+            return False, "unparsed"
+
+        try:
+            if sympy.simplify(diff) == 0:
+                return True, "simplify"
+            else:
+                return False, "simplify"
+        except ValueError:
+            eval_logger.debug(f"Had some trouble simplifying when comparing {x1} and {x2}")
+            return False, "simplify"
     except ImportError as e:
         eval_logger.error(e)
         raise
     except Exception as e:
         eval_logger.debug(f"Failed comparing {x1} and {x2} with {e}")
-        return False
+        return False, "simplify"
 
 
 def get_unnormalized_answer(text: str) -> str:
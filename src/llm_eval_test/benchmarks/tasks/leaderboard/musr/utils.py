@@ -1,11 +1,24 @@
 import ast
 
+import datasets
 
-def doc_to_choice(doc):
+from llm_eval_test.cache import cached_process_docs
+
+
+@cached_process_docs
+def process_docs(dataset: datasets.Dataset) -> datasets.Dataset:
     """
-    Convert a doc to a choice.
+    Parse the choices once and render the numbered choice block used in the prompt.
     """
-    return ast.literal_eval(doc["choices"])
+
+    def _process_doc(doc):
+        choices = ast.literal_eval(doc["choices"])
+        return {
+            "choices": choices,
+            "choices_text": "".join(f"{i + 1} - {choice}\n" for i, choice in enumerate(choices)),
+        }
+
+    return dataset.map(_process_doc)
 
 
 DOC_TO_TEXT = "{narrative}\n\n{question}\n\n{choices}\nAnswer:"
@@ -15,12 +28,4 @@ def doc_to_text(doc):
     """
     Convert a doc to text.
     """
-    choices = ""
-    for i, choice in enumerate(ast.literal_eval(doc["choices"])):
-        choices += f"{i + 1} - {choice}\n"
-
-    text = DOC_TO_TEXT.format(
-        narrative=doc["narrative"], question=doc["question"], choices=choices
-    )
-
-    return text
+    return DOC_TO_TEXT.format(narrative=doc["narrative"], question=doc["question"], choices=doc["choices_text"])
@@ -1,31 +1,49 @@
 import datasets
 import numpy as np
-import sacrebleu
-from rouge_score import rouge_scorer, scoring
+from rouge_score import rouge_scorer, tokenizers
+from sacrebleu.metrics.bleu import BLEU, MAX_NGRAM_ORDER
+from sacrebleu.metrics.helpers import extract_all_word_ngrams
+from sacrebleu.tokenizers.tokenizer_intl import TokenizerV14International
 
+from llm_eval_test.cache import cached_process_docs, map_num_proc
+from llm_eval_test.scoring import batched_process_results
 
-ROUGE_SCORER = None
 
+# Shared so their compiled patterns and caches are reused across documents
+BLEU_TOKENIZER = TokenizerV14International()
+ROUGE_TOKENIZER = tokenizers.DefaultTokenizer(use_stemmer=False)
 
-def process_results_mc2(doc, results):
-    ll, _ = zip(*results)
-    ll = np.array(ll)
 
-    # Convert log-likelihoods to probabilities.
-    probs = np.exp(ll)
+@batched_process_results
+def process_results_mc2(docs, results):
+    # Log-likelihoods of every doc's answers in one array, each doc's answers starting at offsets
+    lengths = np.array([len(doc_results) for doc_results in results])
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    ll = np.array([ll for doc_results in results for ll, _ in doc_results], dtype=np.float64)
+    labels = np.concatenate([doc["mc2_targets"]["labels"] for doc in docs]) == 1
 
-    # Normalize probabilities.
-    probs_norm = probs / np.sum(probs)
+    # Normalize probabilities with a segmented logsumexp, shifting each doc by its max
+    # log-likelihood so long answers don't underflow to zero.
+    probs = np.exp(ll - np.repeat(np.maximum.reduceat(ll, offsets), lengths))
+    # Compute the normalized probability mass for the correct answers.
+    pm_true = np.add.reduceat(np.where(labels, probs, 0.0), offsets) / np.add.reduceat(probs, offsets)
 
-    labels = np.array(doc["mc2_targets"]["labels"])
-    # Compute the normalized probability mass for the correct answer.
-    pm_true = np.sum(probs_norm[labels == 1])
-
-    return {"acc": pm_true}
+    return [{"acc": acc} for acc in pm_true]
 
 
+@cached_process_docs
 def process_docs_gen(dataset: datasets.Dataset) -> datasets.Dataset:
-    return dataset.map(preprocess_function)
+    return dataset.map(preprocess_batch, batched=True, num_proc=map_num_proc())
+
+
+def preprocess_batch(examples):
+    columns = ("question", "correct_answers", "incorrect_answers")
+    out_examples = {column: [] for column in columns}
+    for values in zip(*(examples[column] for column in columns), strict=True):
+        out_example = preprocess_function(dict(zip(columns, values, strict=True)))
+        for column in columns:
+            out_examples[column].append(out_example[column])
+    return out_examples
 
 
 def preprocess_function(examples):
@@ -73,7 +91,7 @@ def process_results_gen(doc, results):
     # bleurt_acc = int(bleurt_correct > bleurt_incorrect)
 
     # BLEU
-    bleu_scores = [bleu([[ref]], [completion]) for ref in all_refs]
+    bleu_scores = sentence_bleu(all_refs, completion)
     bleu_correct = np.nanmax(bleu_scores[: len(true_refs)])
     bleu_incorrect = np.nanmax(bleu_scores[len(true_refs) :])
     bleu_max = bleu_correct
@@ -81,23 +99,23 @@ def process_results_gen(doc, results):
     bleu_acc = int(bleu_correct > bleu_incorrect)
 
     # ROUGE-N
-    rouge_scores = [rouge([ref], [completion]) for ref in all_refs]
+    rouge_scores = sentence_rouge(all_refs, completion)
     # ROUGE-1
-    rouge1_scores = [score["rouge1"] for score in rouge_scores]
+    rouge1_scores = rouge_scores["rouge1"]
     rouge1_correct = np.nanmax(rouge1_scores[: len(true_refs)])
     rouge1_incorrect = np.nanmax(rouge1_scores[len(true_refs) :])
     rouge1_max = rouge1_correct
     rouge1_diff = rouge1_correct - rouge1_incorrect
     rouge1_acc = int(rouge1_correct > rouge1_incorrect)
     # ROUGE-2
-    rouge2_scores = [score["rouge2"] for score in rouge_scores]
+    rouge2_scores = rouge_scores["rouge2"]
     rouge2_correct = np.nanmax(rouge2_scores[: len(true_refs)])
     rouge2_incorrect = np.nanmax(rouge2_scores[len(true_refs) :])
     rouge2_max = rouge2_correct
     rouge2_diff = rouge2_correct - rouge2_incorrect
     rouge2_acc = int(rouge2_correct > rouge2_incorrect)
     # ROUGE-L
-    rougeL_scores = [score["rougeLsum"] for score in rouge_scores]
+    rougeL_scores = rouge_scores["rougeLsum"]
     rougeL_correct = np.nanmax(rougeL_scores[: len(true_refs)])
     rougeL_incorrect = np.nanmax(rougeL_scores[len(true_refs) :])
     rougeL_max = rougeL_correct
@@ -123,58 +141,81 @@ def process_results_gen(doc, results):
     }
 
 
-def bleu(refs, preds):
+def sentence_bleu(refs, pred):
     """
-    Returns `t5` style BLEU scores. See the related implementation:
+    Returns `t5` style BLEU scores of a prediction against each reference, as
+    `sacrebleu.corpus_bleu([pred], [[ref]])` would. See the related implementation:
     https://github.com/google-research/text-to-text-transfer-transformer/blob/3d10afd51ba97ac29eb66ae701eca274488202f7/t5/evaluation/metrics.py#L41
 
+    The prediction is tokenized and its n-grams counted once for all references.
+
     :param refs:
-        A `list` of `list` of reference `str`s.
-    :param preds:
-        A `list` of predicted `str`s.
+        A `list` of reference `str`s.
+    :param pred:
+        The predicted `str`.
     """
-    score = sacrebleu.corpus_bleu(
-        preds,
-        refs,
-        smooth_method="exp",
-        smooth_value=0.0,
-        force=False,
-        lowercase=False,
-        tokenize="intl",
-        use_effective_order=False,
-    ).score
-    return score
-
-
-def rouge(refs, preds):
+    pred_ngrams, pred_len = extract_all_word_ngrams(BLEU_TOKENIZER(pred.rstrip()), 1, MAX_NGRAM_ORDER)
+    total = [0] * MAX_NGRAM_ORDER
+    for ngram, count in pred_ngrams.items():
+        total[len(ngram) - 1] += count
+
+    scores = []
+    for ref in refs:
+        ref_ngrams, ref_len = extract_all_word_ngrams(BLEU_TOKENIZER(ref.rstrip()), 1, MAX_NGRAM_ORDER)
+        correct = [0] * MAX_NGRAM_ORDER
+        for ngram, count in pred_ngrams.items():
+            if ngram in ref_ngrams:
+                correct[len(ngram) - 1] += min(count, ref_ngrams[ngram])
+        score = BLEU.compute_bleu(
+            correct,
+            total,
+            pred_len,
+            ref_len,
+            smooth_method="exp",
+            smooth_value=0.0,
+            effective_order=False,
+            max_ngram_order=MAX_NGRAM_ORDER,
+        ).score
+        scores.append(score)
+    return scores
+
+
+def sentence_rouge(refs, pred):
     """
-    Returns `t5` style ROUGE scores. See the related implementation:
+    Returns `t5` style ROUGE scores of a prediction against each reference, as
+    `rouge_scorer.RougeScorer` would for each pair. See the related implementation:
     https://github.com/google-research/text-to-text-transfer-transformer/blob/3d10afd51ba97ac29eb66ae701eca274488202f7/t5/evaluation/metrics.py#L68
 
+    Bootstrap aggregation of a single score is that score, so it is skipped and the
+    prediction is tokenized once for all references.
+
     :param refs:
-        A `list` of reference `strs`.
-    :param preds:
-        A `list` of predicted `strs`.
+        A `list` of reference `str`s.
+    :param pred:
+        The predicted `str`.
     """
 
-    rouge_types = ["rouge1", "rouge2", "rougeLsum"]
-
-    global ROUGE_SCORER
-    if ROUGE_SCORER is None:
-        # init RougeScorer once (https://github.com/EleutherAI/lm-evaluation-harness/issues/1692)--rouge_types are constant
-        ROUGE_SCORER = rouge_scorer.RougeScorer(rouge_types)
-    scorer = ROUGE_SCORER
     # Add newlines between sentences to correctly compute `rougeLsum`.
-
     def _prepare_summary(summary):
         summary = summary.replace(" . ", ".\n")
         return summary
 
-    # Accumulate confidence intervals.
-    aggregator = scoring.BootstrapAggregator()
-    for ref, pred in zip(refs, preds):
-        ref = _prepare_summary(ref)
-        pred = _prepare_summary(pred)
-        aggregator.add_scores(scorer.score(ref, pred))
-    result = aggregator.aggregate()
-    return {type: result[type].mid.fmeasure * 100 for type in rouge_types}
+    def _tokenize(summary):
+        summary = _prepare_summary(summary)
+        sents = [ROUGE_TOKENIZER.tokenize(sent) for sent in summary.split("\n") if len(sent)]
+        return ROUGE_TOKENIZER.tokenize(summary), sents
+
+    pred_tokens, pred_sents = _tokenize(pred)
+    pred_unigrams = rouge_scorer._create_ngrams(pred_tokens, 1)
+    pred_bigrams = rouge_scorer._create_ngrams(pred_tokens, 2)
+
+    scores = {"rouge1": [], "rouge2": [], "rougeLsum": []}
+    for ref in refs:
+        ref_tokens, ref_sents = _tokenize(ref)
+        rouge1 = rouge_scorer._score_ngrams(rouge_scorer._create_ngrams(ref_tokens, 1), pred_unigrams)
+        rouge2 = rouge_scorer._score_ngrams(rouge_scorer._create_ngrams(ref_tokens, 2), pred_bigrams)
+        rouge_lsum = rouge_scorer._summary_level_lcs(ref_sents, pred_sents)
+        scores["rouge1"].append(rouge1.fmeasure * 100)
+        scores["rouge2"].append(rouge2.fmeasure * 100)
+        scores["rougeLsum"].append(rouge_lsum.fmeasure * 100)
+    return scores
@@ -0,0 +1,158 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+import tarfile
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import zstandard
+
+from llm_eval_test.manifest import MANIFEST_FILE, Manifest, list_repo_files
+
+logger = logging.getLogger("bundle")
+
+TOKENIZERS_DIR = "tokenizers"
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+# Larger files are streamed to disk while reading the bundle instead of being handed to a worker
+STREAM_THRESHOLD = 8 * STREAM_CHUNK_SIZE
+# Bytes read from the bundle but not yet written, per worker
+PENDING_BYTES_PER_JOB = 4 * STREAM_THRESHOLD
+
+
+def write_bundle(datasets_dir: str, bundle_path: str, tokenizer: str | None = None, level: int = 3):
+    """Write the datasets directory, its manifest and optionally a tokenizer to a tar.zst bundle."""
+    # Only dataset files, the manifest goes first and tokenizers are added on request
+    excluded = {MANIFEST_FILE, f"{MANIFEST_FILE}.lock"}
+    files = [
+        f
+        for f in list_repo_files(datasets_dir)
+        if f not in excluded and not f.endswith(".tmp") and f.split(os.sep)[0] != TOKENIZERS_DIR
+    ]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if tokenizer:
+            # Late import to avoid slow cli
+            from transformers import AutoTokenizer
+
+            logger.info(f"Adding tokenizer {tokenizer} to bundle")
+            AutoTokenizer.from_pretrained(tokenizer, use_fast=True).save_pretrained(tmpdir)
+
+        compressor = zstandard.ZstdCompressor(level=level, threads=-1)
+        with open(bundle_path, "wb") as f, compressor.stream_writer(f) as zf:
+            with tarfile.open(fileobj=zf, mode="w|") as tar:
+                # The manifest goes first so imports can check files as they arrive
+                manifest_path = os.path.join(datasets_dir, MANIFEST_FILE)
+                if os.path.exists(manifest_path):
+                    tar.add(manifest_path, arcname=MANIFEST_FILE)
+                else:
+                    logger.warning(f"No manifest in {datasets_dir}, the bundle can't be verified on import")
+
+                for i, name in enumerate(files, start=1):
+                    tar.add(os.path.join(datasets_dir, name), arcname=name)
+                    if i % 1000 == 0:
+                        logger.info(f"Bundled {i}/{len(files)} files")
+
+                if tokenizer:
+                    for name in list_repo_files(tmpdir):
+                        tar.add(os.path.join(tmpdir, name), arcname=f"{TOKENIZERS_DIR}/{tokenizer}/{name}")
+
+    logger.info(f"Wrote {len(files)} files to {bundle_path}")
+
+
+def import_bundle(bundle_path: str, datasets_dir: str, jobs: int = 1) -> list[str]:
+    """Extract a bundle into datasets_dir and check it against its manifest.
+
+    The bundle is decompressed as a single stream. Small files are written by a thread pool, large
+    ones are streamed to disk as they are read, so memory use is bounded whatever the file sizes.
+    Returns the problems found.
+    """
+    os.makedirs(datasets_dir, exist_ok=True)
+    root = os.path.realpath(datasets_dir)
+
+    expected = {}
+    bundle_repos = {}
+    problems = []
+    corrupt = set()
+    lock = threading.Lock()
+    # Bound the file data held in memory while workers catch up, in chunks
+    pending = threading.Semaphore(max(jobs, 1) * PENDING_BYTES_PER_JOB // STREAM_CHUNK_SIZE)
+
+    def write_file(name: str, chunks, mtime: float):
+        path = os.path.join(root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        digest = hashlib.sha256()
+        with open(tmp_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                digest.update(chunk)
+        os.utime(tmp_path, (mtime, mtime))
+        # Rename into place so readers never see a partial file
+        os.replace(tmp_path, path)
+
+        if name in expected and digest.hexdigest() != expected[name]:
+            with lock:
+                problems.append(f"{name}: checksum mismatch")
+                corrupt.add(name)
+
+    def write_pending(name: str, data: bytes, mtime: float, units: int):
+        try:
+            write_file(name, [data], mtime)
+        finally:
+            pending.release(units)
+
+    decompressor = zstandard.ZstdDecompressor()
+    with (
+        open(bundle_path, "rb") as f,
+        decompressor.stream_reader(f) as zf,
+        tarfile.open(fileobj=zf, mode="r|") as tar,
+        ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor,
+    ):
+        futures = []
+        for member in tar:
+            path = os.path.realpath(os.path.join(root, member.name))
+            if os.path.commonpath([root, path]) != root:
+                raise ValueError(f"Refusing to extract {member.name} outside of {datasets_dir}")
+            if not member.isfile():
+                continue
+
+            fileobj = tar.extractfile(member)
+            if member.name == MANIFEST_FILE:
+                bundle_repos = json.load(fileobj).get("repos", {})
+                for dataset_repo, entry in bundle_repos.items():
+                    for name, recorded in entry["files"].items():
+                        expected[f"{dataset_repo}/{name}"] = recorded["sha256"]
+                continue
+
+            if member.size > STREAM_THRESHOLD:
+                write_file(member.name, iter(functools.partial(fileobj.read, STREAM_CHUNK_SIZE), b""), member.mtime)
+                continue
+
+            units = max(1, -(-member.size // STREAM_CHUNK_SIZE))
+            for _ in range(units):
+                pending.acquire()
+            futures.append(executor.submit(write_pending, member.name, fileobj.read(), member.mtime, units))
+        for future in futures:
+            future.result()
+
+    # Files listed in the manifest but absent from the bundle
+    extracted = set(list_repo_files(root))
+    problems.extend(f"{name}: missing" for name in sorted(expected.keys() - extracted))
+
+    # Merge into any existing manifest and record the extracted files' new mtimes
+    manifest = Manifest(datasets_dir)
+    for dataset_repo, entry in bundle_repos.items():
+        files = {}
+        for name, recorded in entry["files"].items():
+            path = os.path.join(root, dataset_repo, name)
+            # Corrupt files are left unrecorded, so downloads fetch them again
+            if os.path.isfile(path) and f"{dataset_repo}/{name}" not in corrupt:
+                files[name] = {**recorded, "mtime_ns": os.stat(path).st_mtime_ns}
+        manifest.add(dataset_repo, {**entry, "files": files})
+    manifest.save()
+
+    return problems
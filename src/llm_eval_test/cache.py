@@ -0,0 +1,139 @@
+import functools
+import hashlib
+import inspect
+import logging
+import os
+import shutil
+import uuid
+
+import datasets
+
+logger = logging.getLogger("llm-eval-test")
+
+# Task utils are imported by lm-eval, so the cache is configured through the environment
+CACHE_DIR_ENV = "LLM_EVAL_TEST_CACHE_DIR"
+CACHE_SIZE_ENV = "LLM_EVAL_TEST_CACHE_SIZE"  # MiB
+SHUFFLE_SEED_ENV = "LLM_EVAL_TEST_SHUFFLE_SEED"
+MAP_PROC_ENV = "LLM_EVAL_TEST_MAP_PROC"
+
+
+def map_num_proc() -> int | None:
+    """Number of processes task preprocessing passes to dataset.map, None to map in the calling process."""
+    num_proc = int(os.getenv(MAP_PROC_ENV, "1"))
+    return num_proc if num_proc > 1 else None
+
+
+def hash_source(func) -> str:
+    """Hash the source file of func, so changes to helpers it calls also change the hash."""
+    with open(inspect.getfile(func), "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class DocsCache:
+    """On-disk cache of processed datasets (or dataset dicts) stored as memory-mapped Arrow files."""
+
+    def __init__(self, cache_dir: str, max_size: int):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    @classmethod
+    def from_env(cls, name: str) -> "DocsCache | None":
+        """Return the cache configured for this process or None if caching is disabled."""
+        cache_dir = os.getenv(CACHE_DIR_ENV)
+        if not cache_dir:
+            return None
+
+        max_size = int(os.getenv(CACHE_SIZE_ENV, "0")) * 1024 * 1024
+        return cls(os.path.join(cache_dir, name), max_size)
+
+    def load(self, key: str) -> datasets.Dataset | datasets.DatasetDict | None:
+        path = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(path):
+            return None
+
+        try:
+            dataset = datasets.load_from_disk(path, keep_in_memory=False)
+        except Exception as e:
+            logger.warning(f"Discarding unreadable cache entry {path}: {e}")
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+
+        try:
+            # Mark as recently used for eviction
+            os.utime(path)
+        except OSError:
+            # Evicted by another process meanwhile, the open dataset stays readable
+            pass
+        return dataset
+
+    def store(self, key: str, dataset: datasets.Dataset | datasets.DatasetDict):
+        path = os.path.join(self.cache_dir, key)
+        tmp_path = os.path.join(self.cache_dir, f".{key}.{uuid.uuid4().hex}")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        try:
+            dataset.save_to_disk(tmp_path)
+            # Rename into place so concurrent readers never see a partial entry
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_size."""
+        if self.max_size <= 0:
+            return
+
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.startswith(".") or not entry.is_dir():
+                continue
+            try:
+                size = sum(
+                    os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(entry.path) for f in files
+                )
+                entries.append((entry.stat().st_mtime, size, entry.path))
+            except OSError:
+                # Removed by another process while we looked
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            logger.debug(f"Evicting cache entry {path}")
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+def cached_process_docs(func=None, *, env: tuple[str, ...] = ()):
+    """Cache the output of a task's process_docs function across runs.
+
+    Entries are keyed by the fingerprint of the input dataset, a hash of the
+    source file defining func and the values of the env variables func reads.
+    """
+    if func is None:
+        return functools.partial(cached_process_docs, env=env)
+
+    source_hash = hash_source(func)
+
+    @functools.wraps(func)
+    def wrapper(dataset):
+        cache = DocsCache.from_env("docs")
+        if cache is None or not isinstance(dataset, datasets.Dataset):
+            return func(dataset)
+
+        env_values = tuple(f"{name}={os.getenv(name, '')}" for name in env)
+        key_parts = (dataset._fingerprint, func.__qualname__, source_hash, datasets.__version__, *env_values)
+        key = hashlib.sha256(":".join(key_parts).encode()).hexdigest()
+        processed = cache.load(key)
+        if processed is not None:
+            logger.debug(f"Loaded processed docs for {func.__module__}.{func.__qualname__} from cache")
+            return processed
+
+        processed = func(dataset)
+        cache.store(key, processed)
+        return processed
+
+    return wrapper
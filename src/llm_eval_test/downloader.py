@@ -1,15 +1,78 @@
+import fnmatch
+import json
 import logging
 import os
+import re
+import shutil
 import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from typing import NamedTuple
 
-from lm_eval.api.group import ConfigurableGroup
-from lm_eval.api.task import ConfigurableTask
-from lm_eval.tasks import TaskManager
+from filelock import Timeout
+from lm_eval.tasks import GROUP_ONLY_KEYS, TaskManager
+from lm_eval.utils import load_yaml_config
+
+from llm_eval_test.manifest import Manifest, repo_lock
+from llm_eval_test.store import STORE_DIR, ArrowStore
 
 logger = logging.getLogger("downloader")
 
+# Repo files needed to load any config of a dataset
+METADATA_FILES = ("README.md", ".gitattributes")
+
+DEFAULT_CATALOG = os.path.join(os.path.dirname(__file__), "benchmarks", "catalog")
+
+# Concurrent file downloads within one repo
+FILE_JOBS = 8
+RETRY_BACKOFF = 1.0  # seconds, doubled on each retry
+
+
+class DatasetSpec(NamedTuple):
+    """The part of a dataset repo a task loads."""
+
+    path: str
+    revision: str | None
+    name: str | None
+    # Empty when the needed files can't be determined, forcing a full download
+    splits: tuple[str, ...]
+
 
-def download_datasets(datasets_dir: str, tasks: list[str], tasks_path: str, force_download: bool = False) -> dict:
+class TaskNode(NamedTuple):
+    """A task, group or tag under a requested task."""
+
+    name: str
+    # lm-eval task list entry running it with the options its groups set
+    entry: str | dict
+    # Merged YAML config of a task, None for groups and tags
+    config: dict | None
+    subtasks: tuple["TaskNode", ...] = ()
+    # Groups reporting aggregate metrics only make sense run whole
+    splittable: bool = True
+
+    def tasks(self) -> dict[str, dict]:
+        """Merged configs of the tasks under this node, keyed by task name."""
+        if self.config is not None:
+            return {self.name: self.config}
+        configs = {}
+        for subtask in self.subtasks:
+            configs.update(subtask.tasks())
+        return configs
+
+
+def download_datasets(
+    datasets_dir: str,
+    tasks: list[str],
+    tasks_path: str,
+    force_download: bool = False,
+    jobs: int = 1,
+    full: bool = False,
+    pack: bool = False,
+    retries: int = 0,
+    hub_cache: str | None = None,
+) -> tuple[dict, dict]:
+    """Download the datasets of tasks, returning the downloaded and failed tasks."""
     task_list = [tasks] if isinstance(tasks, str) else tasks
 
     # TaskManager
@@ -18,72 +81,581 @@ def download_datasets(datasets_dir: str, tasks: list[str], tasks_path: str, forc
         include_defaults=False,
         verbosity=logging.getLevelName(logger.level),
     )
-    # Load tasks and groups
-    task_dict = tm.load_task_or_group(task_list)
-    if not task_dict:
-        logger.error(f"No tasks loaded for {task_list}")
-        return {}
     # Map tasks and subtasks to datasets
-    task_to_dataset = {}
-    for group_or_task_obj, subtasks_or_task in task_dict.items():
-        # Handle the top-level object (could be group or task)
-        if isinstance(group_or_task_obj, ConfigurableGroup | ConfigurableTask):
-            task_name = group_or_task_obj._config.get("group", None) or group_or_task_obj._config.get("task", "unknown")
-            if isinstance(group_or_task_obj, ConfigurableGroup):
-                sub_result = process_task_object(subtasks_or_task, task_name)
-                task_to_dataset.update(sub_result)
-        elif isinstance(group_or_task_obj, str):
-            # if task is standalone type str i.e arc_challenge, arc_easy, etc
-            sub_result = process_task_object(subtasks_or_task, group_or_task_obj)
-            task_to_dataset.update(sub_result)
-        else:
-            logger.warning(f"!! Unexpected key type in task_dict: {type(group_or_task_obj)}")
+    task_to_dataset = resolve_task_datasets(tm, task_list)
+    if not task_to_dataset:
+        logger.error(f"No datasets found for {task_list}")
+        return {}, {}
+
+    return download_task_datasets(datasets_dir, task_to_dataset, force_download, jobs, full, pack, retries, hub_cache)
 
+
+def download_task_datasets(
+    datasets_dir: str,
+    task_to_dataset: dict[str, DatasetSpec],
+    force_download: bool = False,
+    jobs: int = 1,
+    full: bool = False,
+    pack: bool = False,
+    retries: int = 0,
+    hub_cache: str | None = None,
+) -> tuple[dict, dict]:
+    """Download the datasets mapped to tasks, returning the downloaded and failed tasks."""
     logger.info(f"Task mapping to datasets name =>: {task_to_dataset}")
     os.makedirs(datasets_dir, exist_ok=True)
 
+    # Group tasks by (dataset_path, revision) so each repo is only fetched once
+    repo_to_tasks = defaultdict(list)
+    repo_to_subsets = defaultdict(set)
+    for task_name, spec in task_to_dataset.items():
+        repo = (spec.path, spec.revision)
+        repo_to_tasks[repo].append(task_name)
+        repo_to_subsets[repo].add((spec.name, spec.splits))
+    for (dataset_repo, revision), repo_tasks in repo_to_tasks.items():
+        logger.info(f"Dataset {dataset_repo}@{revision or 'main'} used by {len(repo_tasks)} task(s): {repo_tasks}")
+
     # Download datasets
+    manifest = Manifest(datasets_dir)
     local_paths = {}
-    for task_name, dataset_repo in task_to_dataset.items():
-        target_dir = os.path.join(datasets_dir, dataset_repo)  # eg: 'allenai/ai2_arc/ARC-Challenge'
-        logger.info(f"Downloading '{task_name}' dataset from {dataset_repo} to {target_dir}")
-        try:
-            if force_download or not os.path.exists(target_dir):
-                from huggingface_hub import snapshot_download
-
-                with tempfile.TemporaryDirectory() as tmpdir:
-                    snapshot_download(
-                        repo_id=dataset_repo,
-                        repo_type="dataset",
-                        cache_dir=tmpdir,
-                        local_dir=target_dir,
-                        local_dir_use_symlinks=False,  # TODO: Remove as depercated
-                        force_download=True,
-                        token=os.getenv("HF_TOKEN", True),  # Str or True
+    failed = {}
+    total = len(repo_to_tasks)
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = {
+            executor.submit(
+                sync_dataset,
+                datasets_dir,
+                *repo,
+                repo_to_tasks[repo],
+                None if full else repo_to_subsets[repo],
+                force_download,
+                manifest,
+                jobs,
+                retries,
+                hub_cache,
+            ): repo
+            for repo in repo_to_tasks
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            repo = futures[future]
+            dataset_repo, _ = repo
+            repo_tasks = repo_to_tasks[repo]
+            try:
+                commit = future.result()
+            except Exception as e:
+                logger.error(f"[{done}/{total}] Failed to download {dataset_repo}: {e}")
+                failed.update(dict.fromkeys(repo_tasks, str(e)))
+                continue
+
+            if commit:
+                target_dir = os.path.join(datasets_dir, dataset_repo)
+                logger.info(f"[{done}/{total}] Downloaded {dataset_repo} to {target_dir}")
+                local_paths.update(dict.fromkeys(repo_tasks, target_dir))
+            else:
+                logger.info(f"[{done}/{total}] Skipped {dataset_repo}, dataset already exists")
+
+    # Per-repo status summary
+    for (dataset_repo, revision), repo_tasks in repo_to_tasks.items():
+        if repo_tasks[0] in failed:
+            status = "failed"
+        elif repo_tasks[0] in local_paths:
+            status = "downloaded"
+        else:
+            status = "skipped"
+        logger.info(f"{dataset_repo}@{revision or 'main'}: {status} ({len(repo_tasks)} task(s))")
+
+    # Loading scripts are run once here and their output packed, so runs load static Arrow data
+    repo_to_names = defaultdict(set)
+    for task_name, spec in task_to_dataset.items():
+        # Configs loaded with custom data files can't be looked up by name, leave them unpacked
+        if task_name in failed or not spec.splits:
+            continue
+        if pack or has_loading_script(os.path.join(datasets_dir, spec.path)):
+            repo_to_names[spec.path].add(spec.name)
+    if repo_to_names:
+        packed_tasks = [task_name for task_name, spec in task_to_dataset.items() if spec.path in repo_to_names]
+        pack_failed = pack_datasets(datasets_dir, repo_to_names, force_download, packed_tasks, jobs)
+        for task_name, spec in task_to_dataset.items():
+            if (spec.path, spec.name) in pack_failed:
+                failed[task_name] = pack_failed[(spec.path, spec.name)]
+
+    return local_paths, failed
+
+
+def has_loading_script(repo_dir: str) -> bool:
+    """Whether a local dataset repo is loaded through a Python script."""
+    name = os.path.basename(repo_dir)
+    return os.path.isfile(os.path.join(repo_dir, f"{name}.py"))
+
+
+def fetch_tasks(
+    datasets_dir: str,
+    tasks: list[str],
+    tasks_path: str,
+    jobs: int = 1,
+    retries: int = 0,
+    hub_cache: str | None = None,
+):
+    """Download the datasets of tasks in the background, yielding (ready, failed) as repos are done.
+
+    ready is an lm-eval task list of what can now run. A task or group runs whole once all of its
+    datasets are present. Until then, the parts of a group that are ready run under an inline group of
+    the same name, unless it reports aggregate metrics. Repos already present finish first, so their
+    tasks can be run while the rest download.
+    """
+    tm = TaskManager(include_path=tasks_path, include_defaults=False, verbosity=logging.getLevelName(logger.level))
+    # Plan every task up front, lm-eval's YAML loading is not thread safe
+    task_to_dataset = resolve_task_datasets(tm, tasks)
+    roots = [task_node(tm, task) for task in tasks if tm._name_is_registered(task)]
+
+    repo_to_tasks = defaultdict(dict)
+    for task_name, spec in task_to_dataset.items():
+        repo_to_tasks[(spec.path, spec.revision)][task_name] = spec
+    done = {task_name for root in roots for task_name in root.tasks()} - task_to_dataset.keys()
+    started = set()
+
+    def runnable(node: TaskNode) -> str | dict | None:
+        names = node.tasks().keys()
+        if names and names <= done and started.isdisjoint(names):
+            started.update(names)
+            return node.entry
+        if not node.splittable:
+            return None
+        entries = [entry for subtask in node.subtasks if (entry := runnable(subtask)) is not None]
+        return {"group": node.name, "task": entries} if entries else None
+
+    def ready() -> list[str | dict]:
+        return [entry for root in roots if (entry := runnable(root)) is not None]
+
+    # Tasks without a dataset to fetch run first
+    if initial := ready():
+        yield initial, {}
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = {
+            executor.submit(
+                download_task_datasets, datasets_dir, repo_tasks, jobs=jobs, retries=retries, hub_cache=hub_cache
+            ): repo_tasks
+            for repo_tasks in repo_to_tasks.values()
+        }
+        while futures:
+            # Take every repo finished by now, so groups whose datasets are present run whole
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            failed = {}
+            for future in finished:
+                repo_tasks = futures.pop(future)
+                try:
+                    failed.update(future.result()[1])
+                except Exception as e:
+                    failed.update(dict.fromkeys(repo_tasks, str(e)))
+                done.update(task_name for task_name in repo_tasks if task_name not in failed)
+            yield ready(), failed
+
+
+def pack_datasets(
+    datasets_dir: str,
+    repo_to_names: dict[str, set[str | None]],
+    force: bool = False,
+    tasks: list[str] | None = None,
+    jobs: int = 1,
+) -> dict:
+    """Pack downloaded dataset configs into the Arrow store, returning the ones that failed.
+
+    Configs already in the store are kept unless force is set. The store's files are recorded
+    in the manifest, as a repo used by tasks, so they are verified and bundled like the rest.
+    """
+    import datasets
+
+    store = ArrowStore(datasets_dir)
+    failed = {}
+    with store.lock(), tempfile.TemporaryDirectory() as cache_dir:
+        # Another process may have packed these while we waited for the lock
+        store.reload()
+        for dataset_repo, names in repo_to_names.items():
+            for name in sorted(names, key=str):
+                if store.has(dataset_repo, name) and not force:
+                    logger.info(f"Skipped packing {dataset_repo} ({name or 'default'}), already packed")
+                    continue
+
+                logger.info(f"Packing {dataset_repo} ({name or 'default'}) into {store.store_dir}")
+                try:
+                    dataset = datasets.load_dataset(
+                        os.path.join(datasets_dir, dataset_repo),
+                        name,
+                        cache_dir=cache_dir,
+                        trust_remote_code=True,  # Same as the task configs that need it
                     )
-                    local_paths[task_name] = target_dir
+                    store.add(dataset_repo, name, dataset)
+                except Exception as e:
+                    logger.error(f"Failed to pack {dataset_repo} ({name or 'default'}): {e}")
+                    failed[(dataset_repo, name)] = str(e)
+        store.save()
+
+        manifest = Manifest(datasets_dir)
+        manifest.record(STORE_DIR, None, tasks or [], jobs)
+        manifest.save()
+
+    return failed
+
+
+def sync_dataset(
+    datasets_dir: str,
+    dataset_repo: str,
+    revision: str | None,
+    tasks: list[str],
+    subsets: set[tuple[str | None, tuple[str, ...]]] | None = None,
+    force_download: bool = False,
+    manifest: Manifest | None = None,
+    jobs: int = 1,
+    retries: int = 0,
+    hub_cache: str | None = None,
+) -> str | None:
+    """Download and record a dataset repo while holding its lock.
+
+    Concurrent downloads into the same datasets_dir wait for the process holding the lock
+    and then find the repo complete in the manifest, so each repo is only fetched once.
+    """
+    manifest = manifest if manifest is not None else Manifest(datasets_dir)
+    lock = repo_lock(datasets_dir, dataset_repo)
+    try:
+        lock.acquire(blocking=False)
+    except Timeout:
+        logger.info(f"Waiting for another process downloading {dataset_repo}")
+        lock.acquire()
+
+    try:
+        # Pick up what the previous lock holder recorded
+        manifest.reload()
+        commit = download_dataset(
+            datasets_dir, dataset_repo, revision, subsets, force_download, manifest, retries, hub_cache
+        )
+        if commit:
+            manifest.record(dataset_repo, commit, tasks, jobs)
+        elif dataset_repo in manifest.repos:
+            manifest.add_tasks(dataset_repo, tasks)
+        else:
+            logger.warning(f"{dataset_repo} is not in the manifest, use --force-download to record it")
+        # Save before releasing the lock so waiting processes see the repo as complete
+        manifest.save()
+    finally:
+        lock.release()
+
+    return commit
+
+
+def download_dataset(
+    datasets_dir: str,
+    dataset_repo: str,
+    revision: str | None = None,
+    subsets: set[tuple[str | None, tuple[str, ...]]] | None = None,
+    force_download: bool = False,
+    manifest: Manifest | None = None,
+    retries: int = 0,
+    hub_cache: str | None = None,
+) -> str | None:
+    """Download a single dataset repo, returning the downloaded commit or None if skipped.
+
+    If subsets of (config name, splits) are given only the files needed to load them are fetched.
+    Files go through the hub cache, so interrupted downloads resume and unchanged files are reused.
+    """
+    from huggingface_hub import HfApi
+
+    target_dir = os.path.join(datasets_dir, dataset_repo)  # eg: 'allenai/ai2_arc/ARC-Challenge'
+    token = os.getenv("HF_TOKEN", True)  # Str or True
+
+    info = None
+    files = None
+    if subsets is not None:
+        info = with_retries(HfApi().dataset_info, retries, dataset_repo, revision=revision, token=token)
+        repo_files = [sibling.rfilename for sibling in info.siblings or []]
+        card_configs = (info.card_data or {}).get("configs") or []
+        files = select_repo_files(repo_files, card_configs, subsets)
+        if files is None:
+            logger.info(f"Can't determine the files tasks use from {dataset_repo}, downloading the full repo")
+        else:
+            logger.info(f"Selected {len(files)} of {len(repo_files)} files from {dataset_repo}")
+
+    if not force_download:
+        if manifest is not None and dataset_repo in manifest.repos:
+            if files is None and info is None:
+                info = with_retries(HfApi().dataset_info, retries, dataset_repo, revision=revision, token=token)
+            # The full repo is wanted, files recorded by a selective download may not be all of it
+            wanted = files if files is not None else [sibling.rfilename for sibling in info.siblings or []]
+            complete = manifest.is_complete(dataset_repo, wanted)
+        elif files is None:
+            # Downloaded before manifests were recorded
+            complete = os.path.exists(target_dir)
+        else:
+            complete = all(os.path.exists(os.path.join(target_dir, f)) for f in files)
+        if complete:
+            return None
+
+    # Pin the commit so the recorded revision matches the files fetched
+    if info is None:
+        info = with_retries(HfApi().dataset_info, retries, dataset_repo, revision=revision, token=token)
+    if files is None:
+        files = [sibling.rfilename for sibling in info.siblings or []]
+
+    logger.info(f"Downloading {len(files)} files of {dataset_repo}@{info.sha} to {target_dir}")
+    with ThreadPoolExecutor(max_workers=FILE_JOBS) as executor:
+        futures = [
+            executor.submit(
+                download_file, dataset_repo, filename, info.sha, target_dir, force_download, retries, hub_cache, token
+            )
+            for filename in files
+        ]
+    # Every file has had its chance by now, report the first failure
+    for future in futures:
+        future.result()
+
+    return info.sha
+
+
+def download_file(
+    dataset_repo: str,
+    filename: str,
+    commit: str,
+    target_dir: str,
+    force_download: bool = False,
+    retries: int = 0,
+    hub_cache: str | None = None,
+    token: str | bool = True,
+):
+    """Fetch one file into the hub cache and link it into target_dir."""
+    from huggingface_hub import hf_hub_download
+
+    cached_path = with_retries(
+        hf_hub_download,
+        retries,
+        repo_id=dataset_repo,
+        filename=filename,
+        repo_type="dataset",
+        revision=commit,
+        cache_dir=hub_cache,
+        force_download=force_download,
+        token=token,
+    )
+
+    # Hard link the cached blob when possible to avoid storing files twice
+    path = os.path.join(target_dir, filename)
+    if os.path.exists(path) and os.path.samefile(cached_path, path):
+        # Already linked, replacing a link with another to the same file would leave the temporary one
+        return
+    tmp_path = f"{path}.tmp"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(os.path.realpath(cached_path), tmp_path)
+    except OSError:
+        shutil.copyfile(cached_path, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def is_transient_error(e: Exception) -> bool:
+    """Whether a download error is worth retrying."""
+    from huggingface_hub.errors import LocalEntryNotFoundError, OfflineModeIsEnabled
+    from requests import HTTPError, RequestException
+
+    if isinstance(e, OfflineModeIsEnabled):
+        return False
+    if isinstance(e, LocalEntryNotFoundError):
+        # Raised by hf_hub_download when the hub could not be reached
+        return True
+    if isinstance(e, HTTPError) and e.response is not None:
+        return e.response.status_code == 429 or e.response.status_code >= 500
+
+    return isinstance(e, RequestException)
+
+
+def with_retries(func, retries: int, *args, **kwargs):
+    """Call func, retrying transient download errors with exponential backoff."""
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
         except Exception as e:
-            logger.error(f"Failed to download '{task_name}' from {dataset_repo}: {e}")
+            if attempt == retries or not is_transient_error(e):
+                raise
+            delay = RETRY_BACKOFF * 2**attempt
+            logger.warning(f"{e}, retrying in {delay:.0f}s ({attempt + 1}/{retries})")
+            time.sleep(delay)
 
-    return local_paths
 
+def select_repo_files(
+    repo_files: list[str], card_configs: list[dict], subsets: set[tuple[str | None, tuple[str, ...]]]
+) -> list[str] | None:
+    """Select the repo files needed to load each (config name, splits) subset.
 
-def process_task_object(task_obj, task_name=None) -> dict:
-    """ """
-    task_to_dataset = {}
-    if isinstance(task_obj, ConfigurableTask) or isinstance(task_obj, str):
-        # Individual task
-        dataset_path = getattr(task_obj, "DATASET_PATH", None)
-        if dataset_path:
-            task_to_dataset[task_name] = dataset_path
-            logger.info(f"Task '{task_name}' mapped to {dataset_path}")
+    Returns None when the full repo is required.
+    """
+    # Loading scripts pick their own data files
+    if any(f.endswith(".py") and "/" not in f for f in repo_files):
+        return None
+
+    configs = {config.get("config_name", "default"): config for config in card_configs}
+    selected = {f for f in repo_files if f in METADATA_FILES or (f.endswith(".json") and "/" not in f)}
+    for name, splits in subsets:
+        if not splits:
+            return None
+
+        config = configs.get(name or "default")
+        if config is not None:
+            # datasets fails to load a config if any split declared in the card is missing,
+            # so take every data file of the config rather than just the splits in use
+            patterns = card_config_patterns(config)
+            matched = [f for f in repo_files if any(fnmatch.fnmatch(f, pattern) for pattern in patterns)]
         else:
-            logger.warning(f"No DATASET_PATH for task '{task_name}'")
+            # Inferred layout: splits are named in the file path, e.g. data/test-00000-of-00001.parquet
+            prefix = f"{name}/" if name else ""
+            split_re = re.compile(rf"(^|[-._/])({'|'.join(map(re.escape, splits))})([-._/]|$)")
+            matched = [f for f in repo_files if f.startswith(prefix) and split_re.search(f.removeprefix(prefix))]
+
+        if not matched:
+            return None
+        selected.update(matched)
+
+    return sorted(selected)
+
 
-    elif isinstance(task_obj, dict):
-        # Nested dictionary of tasks/groups
-        for sub_name, sub_obj in task_obj.items():
-            sub_result = process_task_object(sub_obj, sub_name)
-            task_to_dataset.update(sub_result)
+def card_config_patterns(config: dict) -> list[str]:
+    """File patterns of a config declared in a dataset card."""
+    data_dir = config.get("data_dir")
+    data_files = config.get("data_files")
+    if data_files is None:
+        return [f"{data_dir}/*"] if data_dir else []
+
+    if isinstance(data_files, str | dict):
+        data_files = [data_files]
+
+    patterns = []
+    for entry in data_files:
+        paths = entry.get("path", []) if isinstance(entry, dict) else entry
+        patterns.extend([paths] if isinstance(paths, str) else paths)
+
+    return [f"{data_dir}/{pattern}" if data_dir else pattern for pattern in patterns]
+
+
+def resolve_task_datasets(tm: TaskManager, tasks: list[str]) -> dict[str, DatasetSpec]:
+    """Map tasks, and the subtasks of groups and tags, to the datasets they load.
+
+    Only the task index and YAML configs are read, no task is built and no dataset is opened.
+    """
+    task_to_dataset = {}
+    for task in tasks:
+        if not tm._name_is_registered(task):
+            logger.error(f"Unknown task '{task}'")
+            continue
+
+        for task_name, config in task_configs(tm, task).items():
+            spec = dataset_spec(config)
+            if spec:
+                task_to_dataset[task_name] = spec
+                logger.info(f"Task '{task_name}' mapped to {spec.path}")
+            else:
+                logger.warning(f"No dataset_path for task '{task_name}'")
 
     return task_to_dataset
+
+
+def task_configs(tm: TaskManager, name_or_config: str | dict, update_config: dict | None = None) -> dict[str, dict]:
+    """Merged YAML configs of the tasks under a task, group or tag, keyed by task name."""
+    return task_node(tm, name_or_config, update_config).tasks()
+
+
+def task_node(tm: TaskManager, name_or_config: str | dict, update_config: dict | None = None) -> TaskNode:
+    """Plan a task, group or tag and everything under it.
+
+    Follows how TaskManager._load_individual_task_or_group expands groups and tags and applies overrides.
+    """
+    config = {"task": name_or_config} if isinstance(name_or_config, str) else dict(name_or_config)
+    name = config.pop("task")
+    if not isinstance(name, str):
+        # Inline group
+        return group_node(tm, {"task": name, **config}, update_config)
+
+    config = {**config, **(update_config or {})}
+    entry = {"task": name, **config} if config else name
+    if tm._name_is_group(name):
+        subtasks = tm._get_tasklist(name)
+        group_config = load_task_yaml(tm, name) if subtasks == -1 else {"group": name, "task": subtasks}
+        return group_node(tm, group_config, config, entry)
+    if tm._name_is_tag(name):
+        return TaskNode(name, entry, None, tuple(task_node(tm, subtask, config) for subtask in tm._get_tasklist(name)))
+
+    if tm._name_is_registered(name):
+        config = {**load_task_yaml(tm, name), **config}
+    if "include" in config:
+        config = {**load_yaml_config(yaml_config={"include": config.pop("include")}, mode="simple"), **config}
+    return TaskNode(name, entry, config)
+
+
+def group_node(
+    tm: TaskManager, group_config: dict, update_config: dict | None = None, entry: str | dict | None = None
+) -> TaskNode:
+    config = {**group_config, **(update_config or {})}
+    # Keys that aren't group options are passed down to every subtask
+    subtask_config = {k: v for k, v in config.items() if k not in GROUP_ONLY_KEYS} or None
+
+    subtasks = []
+    for subtask in config["task"]:
+        if isinstance(subtask, str) and tm._name_is_tag(subtask):
+            subtasks.extend(task_node(tm, tagged, subtask_config) for tagged in tm._get_tasklist(subtask))
+        else:
+            subtasks.append(task_node(tm, subtask, subtask_config))
+    return TaskNode(
+        config.get("group", ""),
+        # Inline groups are run by their config, which passes the overrides on
+        entry if entry is not None else config,
+        None,
+        tuple(subtasks),
+        splittable=not config.get("aggregate_metric_list"),
+    )
+
+
+def load_task_yaml(tm: TaskManager, name: str) -> dict:
+    """Load the YAML config of an indexed task or group, with includes but without importing functions."""
+    yaml_path = tm._get_yaml_path(name)
+    return {} if yaml_path == -1 else load_yaml_config(yaml_path, mode="simple")
+
+
+def dataset_spec(config: dict) -> DatasetSpec | None:
+    """The dataset a merged task config loads, or None if it has none."""
+    if "recipe" in config:
+        # Unitxt tasks load the dataset named in the card of their recipe
+        return unitxt_dataset_spec(config["recipe"])
+
+    dataset_path = config.get("dataset_path")
+    if not isinstance(dataset_path, str) or config.get("custom_dataset"):
+        return None
+
+    dataset_kwargs = config.get("dataset_kwargs") or {}
+    splits = {config.get(key) for key in ("training_split", "validation_split", "test_split", "fewshot_split")}
+    if "data_files" in dataset_kwargs or "data_dir" in dataset_kwargs:
+        # Custom data files are not tied to a config name
+        splits = set()
+
+    return DatasetSpec(
+        path=dataset_path,
+        revision=dataset_kwargs.get("revision"),
+        name=config.get("dataset_name"),
+        splits=tuple(sorted(splits - {None})),
+    )
+
+
+def unitxt_dataset_spec(recipe: str) -> DatasetSpec | None:
+    """The huggingface dataset loaded by the card of a unitxt recipe, looked up in the local catalogs."""
+    args = dict(arg.split("=", 1) for arg in recipe.split(",") if "=" in arg)
+    card = args.get("card")
+    if not card:
+        return None
+
+    for catalog in filter(None, os.getenv("UNITXT_ARTIFACTORIES", DEFAULT_CATALOG).split(":")):
+        card_path = os.path.join(catalog, *card.split(".")) + ".json"
+        if os.path.isfile(card_path):
+            with open(card_path) as f:
+                loader = json.load(f).get("loader", {})
+            if loader.get("__type__") != "load_hf" or "path" not in loader:
+                return None
+            # The card's preprocessing decides which splits are used, so fetch the whole config
+            return DatasetSpec(path=loader["path"], revision=loader.get("revision"), name=loader.get("name"), splits=())
+
+    return None
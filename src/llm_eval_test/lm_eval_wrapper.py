@@ -1,3 +1,5 @@
+import contextlib
+import hashlib
 import json
 import logging
 import os
@@ -12,14 +14,17 @@ from lm_eval.tasks import TaskManager
 from lm_eval.utils import handle_non_serializable, make_table
 from transformers import AutoTokenizer
 
-from llm_eval_test.parser import OutputFormat
+from llm_eval_test.parser import Defaults, OutputFormat
+from llm_eval_test.resolver import DatasetResolver, LocalTaskManager
+from llm_eval_test.scoring import ScorePool
 
 logger = logging.getLogger("llm-eval-test")
 
 
 class LMEvalWrapper:
     @staticmethod
-    def exec(tasks, model, tokenizer, endpoint, **kwargs):
+    def exec(tasks, model, tokenizer, endpoint, **kwargs) -> dict:
+        """Run lm-eval on tasks, returning the tasks skipped as their datasets failed to download."""
         # Fallback to model if tokenizer is not provided
         tokenizer_repo = tokenizer if tokenizer else model
         chat_template = kwargs.get("chat_template", False)
@@ -45,7 +50,9 @@ class LMEvalWrapper:
             except EntryNotFoundError as e:
                 raise RuntimeError("No chat template found for given tokenizer") from e
 
-        with tempfile.TemporaryDirectory() as tokenizer_path:
+        # Scoring workers are shared by every task of the run
+        score_pool = ScorePool(kwargs["score_workers"]) if kwargs["score_workers"] > 1 else None
+        with tempfile.TemporaryDirectory() as tokenizer_path, score_pool or contextlib.nullcontext():
             # Save the modified tokenizer to our temp path
             logger.info(f"Saving tokenizer to {tokenizer_path}")
             tokenizer.save_pretrained(tokenizer_path)
@@ -61,20 +68,51 @@ class LMEvalWrapper:
             }
 
             model_args_str = ",".join([f"{k}={v!s}" for k, v in model_args.items()])
-            tm = TaskManager(
-                include_path=kwargs["tasks_path"], include_defaults=False, verbosity=logging.getLevelName(logger.level)
+            # Resolve task datasets to local storage instead of relying on the working directory
+            tm = LocalTaskManager(
+                DatasetResolver(kwargs["datasets"]),
+                kwargs["load_jobs"],
+                score_pool,
+                LMEvalWrapper.chat_template_id(tokenizer_repo, tokenizer),
+                include_path=kwargs["tasks_path"],
+                include_defaults=False,
+                verbosity=logging.getLevelName(logger.level),
             )
 
-            logger.info("Running lm-eval")
-            results = simple_evaluate(
-                model="local-completions",
-                model_args=model_args_str,
-                apply_chat_template=chat_template,
-                fewshot_as_multiturn=chat_template,
-                tasks=tasks,
-                batch_size=kwargs["batch"],
-                task_manager=tm,
-            )
+            def evaluate(task_list):
+                logger.info(f"Running lm-eval on {task_list}")
+                return simple_evaluate(
+                    model="local-completions",
+                    model_args=model_args_str,
+                    apply_chat_template=chat_template,
+                    fewshot_as_multiturn=chat_template,
+                    tasks=task_list,
+                    batch_size=kwargs["batch"],
+                    task_manager=tm,
+                )
+
+            failed = {}
+            if kwargs.get("fetch_missing"):
+                # Late import to avoid slow cli
+                from llm_eval_test.downloader import fetch_tasks
+
+                # Evaluate each subtask as soon as its datasets are present
+                results = None
+                ready_tasks = fetch_tasks(
+                    kwargs["datasets"],
+                    tasks,
+                    kwargs["tasks_path"],
+                    Defaults.download_jobs,
+                    Defaults.retry_count,
+                )
+                for ready, task_failed in ready_tasks:
+                    if task_failed:
+                        logger.error(f"Skipping {list(task_failed)}, failed to download their datasets")
+                        failed.update(task_failed)
+                    if ready:
+                        results = LMEvalWrapper.merge_results(results, evaluate(ready))
+            else:
+                results = evaluate(tasks)
 
         if results:
             if kwargs.get("output"):
@@ -96,6 +134,32 @@ class LMEvalWrapper:
             if results.get("groups"):
                 print(make_table(results, "groups"))
 
+        return failed
+
+    @staticmethod
+    def chat_template_id(tokenizer_repo: str, tokenizer) -> str:
+        """Identify the chat template prompts are rendered with, for the prompt cache."""
+        # Templates refer to the tokenizer's special tokens, which the repo pins down
+        template = json.dumps(tokenizer.chat_template, sort_keys=True)
+        return hashlib.sha256(f"{tokenizer_repo}:{template}".encode()).hexdigest()
+
+    @staticmethod
+    def merge_results(results: dict | None, new_results: dict | None) -> dict | None:
+        """Merge the results of separate simple_evaluate calls into one."""
+        if not results or not new_results:
+            return results or new_results
+
+        for key, value in new_results.items():
+            # Per-task sections are merged, run-wide metadata is kept from the first call
+            if key == "group_subtasks":
+                # Parts of a group run separately each list their own subtasks
+                for group, subtasks in value.items():
+                    merged = results[key].setdefault(group, [])
+                    merged.extend(subtask for subtask in subtasks if subtask not in merged)
+            elif isinstance(value, dict) and isinstance(results.get(key), dict) and key != "config":
+                results[key].update(value)
+        return results
+
     @staticmethod
     def list_tasks(tasks_path: str):
         tm = TaskManager(include_path=tasks_path, include_defaults=False, verbosity=logging.getLevelName(logger.level))
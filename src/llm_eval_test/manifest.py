@@ -0,0 +1,205 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from filelock import FileLock
+
+logger = logging.getLogger("manifest")
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+LOCKS_DIR = ".locks"
+
+# Directories inside a dataset repo that are not part of the dataset
+IGNORED_DIRS = {".cache", LOCKS_DIR}
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path: str) -> str:
+    """Return the sha256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def list_repo_files(repo_dir: str) -> list[str]:
+    """List files of a local dataset repo relative to its root."""
+    files = []
+    for root, dirs, filenames in os.walk(repo_dir):
+        dirs[:] = [d for d in dirs if d not in IGNORED_DIRS]
+        for filename in filenames:
+            files.append(os.path.relpath(os.path.join(root, filename), repo_dir))
+
+    return sorted(files)
+
+
+def repo_lock_path(datasets_dir: str, dataset_repo: str) -> str:
+    return os.path.join(datasets_dir, LOCKS_DIR, f"{dataset_repo}.lock")
+
+
+def repo_lock(datasets_dir: str, dataset_repo: str) -> FileLock:
+    """Inter-process lock held while a dataset repo is written."""
+    path = repo_lock_path(datasets_dir, dataset_repo)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return FileLock(path)
+
+
+def wait_for_repo(datasets_dir: str, dataset_repo: str):
+    """Block while another process is downloading a dataset repo."""
+    path = repo_lock_path(datasets_dir, dataset_repo)
+    # Read-only volumes can't be written to, so there is nothing to wait for
+    if os.access(path, os.W_OK):
+        with FileLock(path):
+            pass
+
+
+class Manifest:
+    """Record of the dataset repos in a datasets directory, their files and the tasks using them.
+
+    Several processes may share a datasets directory, so only the repos changed by this
+    instance are written back, merged into the manifest on disk under a file lock.
+    """
+
+    def __init__(self, datasets_dir: str):
+        self.datasets_dir = datasets_dir
+        self.path = os.path.join(datasets_dir, MANIFEST_FILE)
+        self.repos: dict[str, dict] = {}
+        self._changed: set[str] = set()
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(f"{self.path}.lock")
+        self.reload()
+
+    def _read(self) -> dict[str, dict]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f).get("repos", {})
+
+    def reload(self):
+        """Pick up repos recorded by other processes, keeping unsaved changes."""
+        with self._lock:
+            repos = self._read()
+            repos.update({dataset_repo: self.repos[dataset_repo] for dataset_repo in self._changed})
+            self.repos = repos
+
+    def save(self):
+        with self._lock, self._file_lock:
+            repos = self._read()
+            for dataset_repo in self._changed:
+                entry = self.repos[dataset_repo]
+                on_disk = repos.get(dataset_repo)
+                if on_disk and on_disk["revision"] == entry["revision"]:
+                    entry["tasks"] = sorted(set(on_disk["tasks"]) | set(entry["tasks"]))
+                repos[dataset_repo] = entry
+
+            # Write then rename so readers never see a partial manifest
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"version": MANIFEST_VERSION, "repos": repos}, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+            self.repos = repos
+            self._changed.clear()
+
+    def add(self, dataset_repo: str, entry: dict):
+        """Set the entry of a repo."""
+        with self._lock:
+            self.repos[dataset_repo] = entry
+            self._changed.add(dataset_repo)
+
+    def record(self, dataset_repo: str, revision: str | None, tasks: list[str], jobs: int = 1):
+        """Hash the files of a downloaded repo and add it to the manifest.
+
+        Files recorded before with the same size and mtime keep their hash.
+        """
+        repo_dir = os.path.join(self.datasets_dir, dataset_repo)
+        entry = self.repos.get(dataset_repo, {})
+        recorded = entry.get("files", {}) if entry.get("revision") == revision else {}
+        files = {f: self._stat(os.path.join(repo_dir, f)) for f in list_repo_files(repo_dir)}
+        changed = [
+            f for f, stat in files.items() if f not in recorded or any(recorded[f][k] != v for k, v in stat.items())
+        ]
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            hashes = dict(
+                zip(changed, executor.map(hash_file, [os.path.join(repo_dir, f) for f in changed]), strict=True)
+            )
+
+        self.add(
+            dataset_repo,
+            {
+                "revision": revision,
+                "tasks": sorted(set(entry.get("tasks", [])) | set(tasks)),
+                "files": {f: {**stat, "sha256": hashes.get(f) or recorded[f]["sha256"]} for f, stat in files.items()},
+            },
+        )
+
+    def add_tasks(self, dataset_repo: str, tasks: list[str]):
+        """Record additional tasks using an already recorded repo."""
+        with self._lock:
+            entry = self.repos[dataset_repo]
+            entry["tasks"] = sorted(set(entry["tasks"]) | set(tasks))
+            self._changed.add(dataset_repo)
+
+    def is_complete(self, dataset_repo: str, files: list[str] | None = None) -> bool:
+        """Check that a recorded repo is present on disk, and has the given files, without hashing."""
+        with self._lock:
+            entry = self.repos.get(dataset_repo)
+        if entry is None:
+            return False
+        if files is not None and not set(files) <= entry["files"].keys():
+            return False
+
+        repo_dir = os.path.join(self.datasets_dir, dataset_repo)
+        for f, recorded in entry["files"].items():
+            path = os.path.join(repo_dir, f)
+            if not os.path.isfile(path) or os.path.getsize(path) != recorded["size"]:
+                return False
+
+        return True
+
+    def verify(self, jobs: int = 1, rehash: bool = False) -> dict[str, list[str]]:
+        """Verify recorded repos against the files on disk.
+
+        Only files whose size or mtime changed are re-hashed unless rehash is set.
+        Returns the problems found per repo.
+        """
+        problems: dict[str, list[str]] = {}
+        to_hash = []
+        for dataset_repo, entry in self.repos.items():
+            repo_dir = os.path.join(self.datasets_dir, dataset_repo)
+            for f, recorded in entry["files"].items():
+                path = os.path.join(repo_dir, f)
+                if not os.path.isfile(path):
+                    problems.setdefault(dataset_repo, []).append(f"{f}: missing")
+                    continue
+
+                stat = self._stat(path)
+                if stat["size"] != recorded["size"]:
+                    problems.setdefault(dataset_repo, []).append(f"{f}: size {stat['size']} != {recorded['size']}")
+                elif rehash or stat["mtime_ns"] != recorded["mtime_ns"]:
+                    to_hash.append((dataset_repo, f, path, stat))
+
+        logger.info(f"Hashing {len(to_hash)} changed file(s)")
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            hashes = executor.map(hash_file, [path for _, _, path, _ in to_hash])
+            for (dataset_repo, f, _, stat), sha in zip(to_hash, hashes, strict=True):
+                recorded = self.repos[dataset_repo]["files"][f]
+                if sha != recorded["sha256"]:
+                    problems.setdefault(dataset_repo, []).append(f"{f}: checksum mismatch")
+                else:
+                    # Content unchanged, remember the new mtime to skip hashing next time
+                    recorded["mtime_ns"] = stat["mtime_ns"]
+                    self._changed.add(dataset_repo)
+
+        return problems
+
+    @staticmethod
+    def _stat(path: str) -> dict:
+        stat = os.stat(path)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
@@ -21,6 +21,14 @@ class Defaults:
 
     batch_size: int = 32
     retry_count: int = 5
+    download_jobs: int = 8
+    hash_jobs: int = os.cpu_count() or 1
+    load_jobs: int = os.cpu_count() or 1
+    preprocess_jobs: int = 1
+    score_workers: int = 1
+    cache_dir: str = os.path.join(os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "llm-eval-test")
+    cache_size: int = 10240  # MiB
+    shuffle_seed: int = 0
     log_level: int = logging.INFO
 
 
@@ -108,6 +116,62 @@ def setup_parser(local_dir: str, work_dir: str) -> argparse.ArgumentParser:
         help="max number of times to retry a single request",
         metavar="INT",
     )
+    parser_run.add_argument(
+        "--load-jobs",
+        default=Defaults.load_jobs,
+        type=int,
+        help="max number of tasks to build concurrently before evaluation",
+        metavar="INT",
+    )
+    parser_run.add_argument(
+        "--preprocess-jobs",
+        default=Defaults.preprocess_jobs,
+        type=int,
+        help="number of processes for each task's dataset preprocessing, worth raising for large datasets",
+        metavar="INT",
+    )
+    parser_run.add_argument(
+        "--score-workers",
+        default=Defaults.score_workers,
+        type=int,
+        help="number of processes scoring responses, worth raising for tasks with slow scoring such as math and ifeval, each runs its math answer checks one at a time",
+        metavar="INT",
+    )
+    cache_group = parser_run.add_mutually_exclusive_group()
+    cache_group.add_argument(
+        "--cache-dir",
+        default=Defaults.cache_dir,
+        help="cache directory for preprocessed datasets and rendered prompts",
+        metavar="PATH",
+    )
+    cache_group.add_argument(
+        "--no-cache",
+        action="store_const",
+        dest="cache_dir",
+        const=None,
+        help="disable the preprocessed dataset and prompt cache",
+    )
+    parser_run.add_argument(
+        "--cache-size",
+        default=Defaults.cache_size,
+        type=int,
+        help="max size of each cache in MiB, 0 for unlimited",
+        metavar="INT",
+    )
+    parser_run.add_argument(
+        "--fetch-missing",
+        action=argparse.BooleanOptionalAction,
+        type=bool,
+        default=False,
+        help="download missing datasets in the background and run each task once its datasets are ready",
+    )
+    parser_run.add_argument(
+        "--shuffle-seed",
+        default=Defaults.shuffle_seed,
+        type=int,
+        help="seed for tasks that shuffle answer choices, each document is shuffled the same way every run",
+        metavar="INT",
+    )
     now_time = datetime.datetime.now(datetime.UTC).strftime("%Y-%m-%dT%H-%M-%S.%fZ")
     output_group = parser_run.add_mutually_exclusive_group()
     output_group.add_argument(
@@ -165,4 +229,85 @@ def setup_parser(local_dir: str, work_dir: str) -> argparse.ArgumentParser:
         default=False,
         help="Force download datasets even it already exist",
     )
+    parser_download.add_argument(
+        "-j",
+        "--jobs",
+        default=Defaults.download_jobs,
+        type=int,
+        help="max number of datasets to download concurrently",
+        metavar="INT",
+    )
+    parser_download.add_argument(
+        "--full",
+        action=argparse.BooleanOptionalAction,
+        type=bool,
+        default=False,
+        help="download entire dataset repos instead of only the configs and splits tasks use",
+    )
+    parser_download.add_argument(
+        "--pack",
+        action=argparse.BooleanOptionalAction,
+        type=bool,
+        default=False,
+        help="pack downloaded datasets into a memory-mapped Arrow store for faster loading",
+    )
+    parser_download.add_argument(
+        "-r",
+        "--retry",
+        default=Defaults.retry_count,
+        type=int,
+        help="max number of times to retry a single file download",
+        metavar="INT",
+    )
+    parser_download.add_argument(
+        "--hub-cache",
+        help="huggingface hub cache used to resume downloads and reuse unchanged files (default: HF_HUB_CACHE)",
+        metavar="PATH",
+    )
+    parser_download.add_argument(
+        "--bundle", help="write the dataset directory to a single zstd-compressed tar bundle", metavar="PATH"
+    )
+    parser_download.add_argument(
+        "-T", "--tokenizer", help="path or huggingface tokenizer name to include in the bundle"
+    )
+    parser_verify = subparsers.add_parser(
+        "verify",
+        description="verify downloaded datasets against their manifest",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        parents=[parser_base],
+    )
+    parser_verify.add_argument(
+        "-d", "--datasets", type=dir_path, default=f"{work_dir}/datasets", help="Dataset directory"
+    )
+    parser_verify.add_argument(
+        "-j",
+        "--jobs",
+        default=Defaults.hash_jobs,
+        type=int,
+        help="max number of files to hash concurrently",
+        metavar="INT",
+    )
+    parser_verify.add_argument(
+        "--rehash",
+        action=argparse.BooleanOptionalAction,
+        type=bool,
+        default=False,
+        help="hash every file, not only files whose size or mtime changed",
+    )
+    parser_import = subparsers.add_parser(
+        "import-bundle",
+        description="extract a dataset bundle and verify it against its manifest",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        parents=[parser_base],
+    )
+    parser_import.add_argument("bundle", help="bundle written by download --bundle")
+    parser_import.add_argument("-d", "--datasets", default=f"{work_dir}/datasets", help="Dataset directory")
+    parser_import.add_argument(
+        "-j",
+        "--jobs",
+        default=Defaults.hash_jobs,
+        type=int,
+        help="max number of files to write concurrently",
+        metavar="INT",
+    )
     return parser
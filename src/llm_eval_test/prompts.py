@@ -0,0 +1,118 @@
+import hashlib
+import inspect
+import json
+import logging
+import os
+
+import datasets
+import lm_eval
+from lm_eval.api.task import ConfigurableTask
+
+from llm_eval_test.cache import DocsCache, hash_source
+
+logger = logging.getLogger("llm-eval-test")
+
+# Config keys that locate the dataset rather than describe the task, the docs fingerprints cover them
+UNHASHED_CONFIG_KEYS = {"custom_dataset", "dataset_path"}
+
+
+def json_default(value) -> str:
+    """Serialize functions nested in configs by name rather than by a repr holding their address."""
+    return value.__qualname__ if inspect.isfunction(value) else str(value)
+
+
+class PromptCachingTask(ConfigurableTask):
+    """ConfigurableTask that stores its rendered contexts in the cache and reuses them across runs.
+
+    Contexts are keyed by the task config, the docs and the few-shot and chat settings, so
+    evaluating another model on the same tasks skips prompt construction. The prefix shared by
+    every context of a task, typically the few-shot examples, is stored once.
+    """
+
+    # Identity of the chat template contexts are rendered with, lm-eval's tokenizer_name is
+    # empty for API models. Contexts using a chat template aren't cached without it.
+    chat_template_id: str | None = None
+    _cached_contexts = None
+    _rendered_contexts = None
+
+    def prompt_cache_key(self, build_kwargs: dict) -> str | None:
+        """Key of the contexts built with build_kwargs, or None if they can't be cached."""
+        eval_docs = self.eval_docs
+        fewshot_docs = self.fewshot_docs() if self.config.num_fewshot else None
+        # Few-shot samples listed in the config, or returned by a function of it, are covered by the
+        # config and function hashes below
+        samples = (self.config.fewshot_config or {}).get("samples")
+        if not isinstance(eval_docs, datasets.Dataset) or not (
+            isinstance(fewshot_docs, datasets.Dataset | None) or samples is not None
+        ):
+            return None
+        chat_template_id = self.chat_template_id if build_kwargs.get("apply_chat_template") else ""
+        if chat_template_id is None:
+            return None
+
+        config = {k: v for k, v in self.dump_config().items() if k not in UNHASHED_CONFIG_KEYS}
+        # Helpers called by the config's functions aren't part of their serialized source
+        functions = [inspect.unwrap(v) for v in [*vars(self.config).values(), samples] if inspect.isfunction(v)]
+        sources = sorted(hash_source(func) for func in functions if inspect.getsourcefile(func))
+        # The chat template is identified by chat_template_id
+        build_settings = {
+            k: v
+            for k, v in build_kwargs.items()
+            if k not in ("chat_template", "cache_requests", "rewrite_requests_cache")
+        }
+        key_parts = (
+            json.dumps(config, sort_keys=True, default=json_default),
+            json.dumps(build_settings, sort_keys=True, default=json_default),
+            eval_docs._fingerprint,
+            fewshot_docs._fingerprint if isinstance(fewshot_docs, datasets.Dataset) else "",
+            hashlib.sha256(repr(self.fewshot_rnd.getstate()).encode()).hexdigest() if self.fewshot_rnd else "",
+            chat_template_id,
+            *sources,
+            lm_eval.__version__,
+        )
+        return hashlib.sha256(":".join(key_parts).encode()).hexdigest()
+
+    def build_all_requests(self, **kwargs) -> None:
+        cache = DocsCache.from_env("prompts")
+        key = self.prompt_cache_key(kwargs) if cache is not None else None
+        if key is None:
+            return super().build_all_requests(**kwargs)
+
+        cached = cache.load(key)
+        if cached is not None:
+            logger.debug(f"Loaded contexts for {self.config.task} from cache")
+            prefix = cached["prefix"][0]["text"]
+            self._cached_contexts = iter([prefix + suffix for suffix in cached["contexts"]["suffix"]])
+        else:
+            self._rendered_contexts = []
+
+        try:
+            super().build_all_requests(**kwargs)
+            rendered = self._rendered_contexts
+        finally:
+            self._cached_contexts = None
+            self._rendered_contexts = None
+
+        # Chat messages that weren't rendered to a string are left uncached
+        if rendered and all(isinstance(ctx, str) for ctx in rendered):
+            prefix = os.path.commonprefix(rendered)
+            cache.store(
+                key,
+                datasets.DatasetDict(
+                    {
+                        "prefix": datasets.Dataset.from_dict({"text": [prefix]}),
+                        "contexts": datasets.Dataset.from_dict({"suffix": [ctx[len(prefix) :] for ctx in rendered]}),
+                    }
+                ),
+            )
+
+    def fewshot_context(self, doc, num_fewshot, *args, **kwargs):
+        if self._cached_contexts is not None:
+            ctx = next(self._cached_contexts, None)
+            if ctx is not None:
+                return ctx
+
+        ctx = super().fewshot_context(doc, num_fewshot, *args, **kwargs)
+        if self._rendered_contexts is not None:
+            self._rendered_contexts.append(ctx)
+        return ctx
@@ -0,0 +1,233 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import datasets
+from lm_eval.api.task import ConfigurableTask, TaskConfig
+from lm_eval.tasks import TaskManager
+
+from llm_eval_test.manifest import wait_for_repo
+from llm_eval_test.prompts import PromptCachingTask
+from llm_eval_test.scoring import BatchScoringTask, ScorePool
+from llm_eval_test.store import ArrowStore
+
+logger = logging.getLogger("llm-eval-test")
+
+WRAPPERS_DIR = os.path.join(os.path.dirname(__file__), "wrappers")
+
+# Config key holding the class of a python task while its construction is deferred
+DEFERRED_CLASS_KEY = "_llm_eval_test_class"
+
+# Task config keys naming the splits a task reads
+SPLIT_KEYS = ("training_split", "validation_split", "test_split", "fewshot_split")
+
+# Held while datasets loads a dataset, it isn't thread safe (tqdm's thread_map races on its class lock)
+DATASETS_LOCK = threading.Lock()
+
+
+def load_splits(
+    dataset_path: str, dataset_name: str | None, splits: tuple[str, ...], dataset_kwargs: dict
+) -> datasets.DatasetDict:
+    """Load only the given splits of a local dataset, so other splits are never prepared.
+
+    Callers building tasks concurrently hold DATASETS_LOCK.
+    """
+    builder = datasets.load_dataset_builder(dataset_path, dataset_name, **dataset_kwargs)
+    data_files = builder.config.data_files
+    if not data_files or not set(splits) <= data_files.keys():
+        # Loading scripts pick their own files, load every split
+        return datasets.load_dataset(dataset_path, dataset_name, **dataset_kwargs)
+
+    return datasets.load_dataset(
+        dataset_path, dataset_name, data_files={split: data_files[split] for split in splits}, **dataset_kwargs
+    )
+
+
+class DatasetResolver:
+    """Map task dataset paths (e.g. cais/mmlu) to the packed store or local directories."""
+
+    def __init__(self, datasets_dir: str, search_paths: list[str] | None = None):
+        # Wrappers take precedence over datasets, matching the previous symlink order
+        self.datasets_dir = datasets_dir
+        self.search_paths = search_paths if search_paths is not None else [WRAPPERS_DIR, datasets_dir]
+        self.store = ArrowStore(datasets_dir)
+        self._resolved: dict[str, str | None] = {}
+
+    def resolve(self, dataset_path: str) -> str | None:
+        """Return the local directory for dataset_path or None if it is not staged."""
+        if dataset_path not in self._resolved:
+            local_path = None
+            for search_path in self.search_paths:
+                candidate = os.path.join(search_path, dataset_path)
+                if os.path.isdir(candidate):
+                    if search_path == self.datasets_dir:
+                        # Don't read a repo that a concurrent download is still writing
+                        wait_for_repo(search_path, dataset_path)
+                    local_path = os.path.abspath(candidate)
+                    break
+            if not local_path:
+                # Not remembered, the repo may still be downloaded by --fetch-missing
+                logger.warning(f"Dataset '{dataset_path}' not found locally")
+                return None
+            logger.debug(f"Resolved dataset '{dataset_path}' to {local_path}")
+            self._resolved[dataset_path] = local_path
+
+        return self._resolved[dataset_path]
+
+    def load_dataset(self, config: TaskConfig) -> datasets.DatasetDict | None:
+        """Load the splits a task config uses from local storage, or None if it isn't staged."""
+        dataset_path, dataset_name = config.dataset_path, config.dataset_name
+        if not isinstance(dataset_path, str) or config.custom_dataset is not None:
+            return None
+
+        dataset_kwargs = config.dataset_kwargs or {}
+        splits = tuple(sorted({getattr(config, key) for key in SPLIT_KEYS if getattr(config, key)}))
+        if not self.store.has(dataset_path, dataset_name):
+            # Pick up datasets packed since the index was read, e.g. by --fetch-missing
+            self.store.reload()
+        if self.store.has(dataset_path, dataset_name):
+            return self.store.load(dataset_path, dataset_name, splits)
+
+        local_path = self.resolve(dataset_path)
+        if not local_path:
+            return None
+        with DATASETS_LOCK:
+            # Custom data files already select what is loaded
+            if splits and "data_files" not in dataset_kwargs and "data_dir" not in dataset_kwargs:
+                return load_splits(local_path, dataset_name, splits, dataset_kwargs)
+            return datasets.load_dataset(local_path, dataset_name, **dataset_kwargs)
+
+
+class DeferredTask:
+    """Placeholder lm-eval builds in place of a task, so tasks can be built together afterwards.
+
+    Set as the class of a task config, lm-eval constructs it with the final merged config.
+    """
+
+    def __init__(self, config: dict | None = None):
+        self.config = config or {}
+
+
+class LocalTask(PromptCachingTask, BatchScoringTask):
+    """Task built from a YAML config by LocalTaskManager, loading its dataset through a DatasetResolver.
+
+    The config is left as written, so results list the dataset repo rather than local paths.
+    """
+
+    def __init__(self, *args, resolver: DatasetResolver | None = None, **kwargs):
+        # Set before ConfigurableTask.__init__, which downloads the dataset
+        self.resolver = resolver
+        super().__init__(*args, **kwargs)
+
+    def download(self, dataset_kwargs=None, **kwargs) -> None:
+        dataset = self.resolver.load_dataset(self.config) if self.resolver is not None else None
+        if dataset is None:
+            with DATASETS_LOCK:
+                return super().download(dataset_kwargs, **kwargs)
+        self.dataset = dataset
+
+
+class LocalTaskManager(TaskManager):
+    """TaskManager that loads task datasets through a DatasetResolver and builds tasks concurrently.
+
+    Tasks built from YAML configs score their responses in score_pool when one is given, and
+    cache contexts rendered with the chat template identified by chat_template_id.
+    """
+
+    def __init__(
+        self,
+        resolver: DatasetResolver,
+        jobs: int = 1,
+        score_pool: ScorePool | None = None,
+        chat_template_id: str | None = None,
+        **kwargs,
+    ):
+        self.resolver = resolver
+        self.jobs = jobs
+        self.score_pool = score_pool
+        self.chat_template_id = chat_template_id
+        super().__init__(**kwargs)
+
+    @staticmethod
+    def _defer(config: dict) -> dict:
+        return {**config, DEFERRED_CLASS_KEY: config.get("class"), "class": DeferredTask}
+
+    def _get_config(self, name):
+        config = super()._get_config(name)
+        if self._name_is_task(name) or self._name_is_python_task(name):
+            # Defer building so load_task_or_group can build every task at once from its final config
+            config = self._defer(config)
+        return config
+
+    def _load_individual_task_or_group(self, name_or_config=None, parent_name=None, update_config=None):
+        # Inline task configs that aren't registered don't go through _get_config
+        if (
+            isinstance(name_or_config, dict)
+            and self._config_is_task(name_or_config)
+            and not self._name_is_registered(name_or_config["task"])
+        ):
+            name_or_config = self._defer(name_or_config)
+
+        return super()._load_individual_task_or_group(name_or_config, parent_name, update_config)
+
+    def _build_task(self, task_name: str, deferred: DeferredTask):
+        """Build a deferred task as TaskManager._load_individual_task_or_group would have."""
+        config = dict(deferred.config)
+        task_class = config.pop(DEFERRED_CLASS_KEY)
+        if task_class is None:
+            del config["class"]
+            config["metadata"] = config.get("metadata", {}) | (self.metadata or {})
+            task_object = LocalTask(config=config, resolver=self.resolver)
+            task_object.chat_template_id = self.chat_template_id
+            if self.score_pool is not None and callable(task_object.config.process_results):
+                task_object.score_pool = self.score_pool
+                self.score_pool.register(task_object.config.process_results)
+            return task_object
+
+        config["class"] = task_class
+        # Python tasks load their datasets however they like
+        with DATASETS_LOCK:
+            if self._class_has_config_in_constructor(task_class):
+                task_object = task_class(config=config)
+            else:
+                task_object = task_class()
+        if isinstance(task_object, ConfigurableTask):
+            task_object.config.task = task_name
+        return task_object
+
+    def load_task_or_group(self, task_list=None) -> dict:
+        return self._build_tasks(super().load_task_or_group(task_list))
+
+    def load_config(self, config: dict):
+        # lm-eval loads inline configs in its task list one by one through here
+        return self._build_tasks(super().load_config(config))
+
+    def _build_tasks(self, task_dict: dict) -> dict:
+        """Build the deferred tasks of a loaded task dict in parallel."""
+        deferred = []
+
+        def collect(tasks: dict):
+            for name, task in tasks.items():
+                if isinstance(task, dict):
+                    collect(task)
+                elif isinstance(task, DeferredTask):
+                    deferred.append((name, task))
+
+        collect(task_dict)
+        if not deferred:
+            return task_dict
+
+        logger.info(f"Building {len(deferred)} tasks with {self.jobs} workers")
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            built = list(executor.map(lambda item: self._build_task(*item), deferred))
+        replacements = {id(task): task_object for (_, task), task_object in zip(deferred, built, strict=True)}
+
+        def replace(tasks: dict) -> dict:
+            # Rebuilt in place order so results are listed as if built serially
+            return {
+                name: replace(task) if isinstance(task, dict) else replacements.get(id(task), task)
+                for name, task in tasks.items()
+            }
+
+        return replace(task_dict)
@@ -0,0 +1,307 @@
+import functools
+import importlib.util
+import inspect
+import logging
+import multiprocessing
+import os
+import threading
+from collections import Counter, defaultdict, deque
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from lm_eval.api.task import ConfigurableTask
+
+logger = logging.getLogger("llm-eval-test")
+
+# Chunks handed to each worker per task, enough to balance documents that are slow to score
+CHUNKS_PER_WORKER = 8
+# Restarts of a sandbox that dies before it is ready, before its calls fail
+SANDBOX_START_RETRIES = 2
+# Metrics key of counts a batch function reports per doc, summed and logged once per task
+SCORING_STATS_KEY = "scoring_stats"
+
+FunctionRef = tuple[str, str]
+
+
+def function_ref(func: Callable) -> FunctionRef | None:
+    """Return the file and name a module level function can be loaded from, or None."""
+    name = getattr(func, "__qualname__", "")
+    # Decorated functions are defined where the decorator is applied, not where the wrapper is
+    func = inspect.unwrap(func)
+    source = inspect.getsourcefile(func) if inspect.isfunction(func) else None
+    if not source or "<" in name:
+        return None
+    return os.path.abspath(source), name
+
+
+@functools.cache
+def load_function(path: str, name: str) -> Callable:
+    """Load a function from a source file as lm-eval loads !function task utils.
+
+    Task utils are imported outside of sys.modules, so they can't be pickled by reference.
+    """
+    module_name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return functools.reduce(getattr, name.split("."), module)
+
+
+def batched_process_results(func: Callable[[list[dict], list[list]], list[dict]]) -> Callable[[dict, list], dict]:
+    """Decorator turning a function scoring many documents into a process_results function.
+
+    func takes the docs and their results and returns the metrics of each doc, which may count
+    how each was scored under SCORING_STATS_KEY. Tasks built by LocalTaskManager call it once with
+    every document and log the counts, other callers score one doc at a time and drop them.
+    """
+
+    @functools.wraps(func)
+    def wrapper(doc: dict, results: list) -> dict:
+        metrics = func([doc], [results])[0]
+        metrics.pop(SCORING_STATS_KEY, None)
+        return metrics
+
+    wrapper.batch = func
+    return wrapper
+
+
+def _warm(refs: list[FunctionRef]):
+    # Import scoring dependencies (sympy, nltk, ...) before the first document arrives
+    for ref in refs:
+        load_function(*ref)
+
+
+def _score(ref: FunctionRef, item: tuple[dict, list]) -> dict:
+    return load_function(*ref)(*item)
+
+
+def _score_batch(ref: FunctionRef, items: list[tuple[dict, list]]) -> list[dict]:
+    docs, results = zip(*items, strict=True)
+    return load_function(*ref).batch(list(docs), list(results))
+
+
+class ScorePool:
+    """Process pool that scores (doc, results) pairs with the process_results functions of tasks.
+
+    Workers are started on first use and import the functions registered by then.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._refs: dict[FunctionRef, None] = {}
+        self._executor: ProcessPoolExecutor | None = None
+
+    def register(self, func: Callable):
+        """Have workers import func when they start."""
+        ref = function_ref(func)
+        if ref is not None:
+            self._refs[ref] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            logger.info(f"Starting {self.workers} scoring workers")
+            # Spawned rather than forked as the main process runs request threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm,
+                initargs=(list(self._refs),),
+            )
+        return self._executor
+
+    def map(self, func: Callable, items: list[tuple[dict, list]]) -> list[dict]:
+        """Return func(doc, results) for each item, in order."""
+        ref = function_ref(func)
+        if ref is None:
+            # Closures and other objects workers can't load are scored here
+            return [func(*item) for item in items]
+
+        chunksize = max(1, len(items) // (self.workers * CHUNKS_PER_WORKER))
+        return list(self._get_executor().map(_score, repeat(ref), items, chunksize=chunksize))
+
+    def map_batches(self, func: Callable, items: list[tuple[dict, list]]) -> list[dict]:
+        """Score items with the batch function of a batched_process_results function, one slice per worker."""
+        ref = function_ref(func)
+        if ref is None:
+            docs, results = zip(*items, strict=True)
+            return func.batch(list(docs), list(results))
+
+        size = -(-len(items) // self.workers)
+        batches = [items[i : i + size] for i in range(0, len(items), size)]
+        return [metrics for batch in self._get_executor().map(_score_batch, repeat(ref), batches) for metrics in batch]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _sandbox_worker(conn, ref: FunctionRef, warmup_args: tuple | None):
+    try:
+        func = load_function(*ref)
+        if warmup_args is not None:
+            # Lazy imports of the first call shouldn't count against its deadline
+            func(*warmup_args)
+    except Exception as e:
+        conn.send(e)
+        return
+    conn.send(None)
+    while True:
+        try:
+            args = conn.recv()
+        except EOFError:
+            return
+        try:
+            conn.send((True, func(*args)))
+        except Exception as e:
+            conn.send((False, e))
+
+
+class SandboxedFunction:
+    """Call a module level function in a separate process with a wall-clock deadline.
+
+    Calls that overrun the deadline, or crash the process, return default and the process is
+    killed and replaced. Unlike signal.alarm this works from any thread, to the sub-second, and
+    stops functions stuck in C code.
+    """
+
+    def __init__(self, func: Callable, timeout: float, default=None, warmup_args: tuple | None = None):
+        self.ref = function_ref(func)
+        if self.ref is None:
+            raise ValueError(f"{func!r} can't be loaded in a separate process")
+        self.timeout = timeout
+        self.default = default
+        self.warmup_args = warmup_args
+        self._lock = threading.Lock()
+        self._process = None
+        self._conn = None
+        self._ready = False
+        self._error = None
+
+    def _start(self):
+        context = multiprocessing.get_context("spawn")
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(
+            target=_sandbox_worker, args=(child_conn, self.ref, self.warmup_args), daemon=True
+        )
+        self._process.start()
+        child_conn.close()
+        self._ready = False
+
+    def _wait_ready(self):
+        # Imports aren't subject to the deadline
+        for attempt in range(SANDBOX_START_RETRIES + 1):
+            try:
+                error = self._conn.recv()
+                break
+            except EOFError:
+                # Died without a word, e.g. killed for memory, which may not happen again
+                self._kill()
+                if attempt < SANDBOX_START_RETRIES:
+                    logger.warning(f"Sandbox of {self.ref[1]} exited while starting, restarting it")
+                    self._start()
+        else:
+            error = RuntimeError(f"Sandbox of {self.ref[1]} exited while starting {SANDBOX_START_RETRIES + 1} times")
+
+        if error is not None:
+            # Missing dependencies won't appear on restart, fail every call instead of respawning
+            if self._process is not None:
+                self._kill()
+            # Callers may swallow the exception, so say it once here
+            logger.error(f"Sandbox of {self.ref[1]} failed to start, every call will raise: {error!r}")
+            self._error = error
+            raise error
+        self._ready = True
+
+    def _kill(self):
+        self._process.kill()
+        self._process.join()
+        self._conn.close()
+        self._process = None
+        self._conn = None
+
+    def __call__(self, *args):
+        with self._lock:
+            if self._error is not None:
+                raise self._error
+            if self._process is None:
+                self._start()
+            if not self._ready:
+                self._wait_ready()
+            try:
+                self._conn.send(args)
+                if self._conn.poll(self.timeout):
+                    ok, value = self._conn.recv()
+                    if not ok:
+                        raise value
+                    return value
+                logger.debug(f"{self.ref[1]}{args} timed out after {self.timeout}s")
+            except (EOFError, BrokenPipeError):
+                logger.debug(f"{self.ref[1]}{args} crashed its process")
+            # Start the replacement now so it imports while the caller carries on
+            self._kill()
+            self._start()
+            return self.default
+
+
+class BatchScoringTask(ConfigurableTask):
+    """ConfigurableTask that scores all of its responses at once when they are filtered.
+
+    Responses are scored by the batch function of a batched_process_results function, in a
+    ScorePool or both. lm-eval calls process_results for each filter and document in turn right after
+    apply_filters, so the results are computed up front in that order and handed out as it asks.
+    """
+
+    score_pool: ScorePool | None = None
+    _scored: deque | None = None
+
+    def apply_filters(self):
+        filtered = super().apply_filters()
+        self._scored = None
+        batch = getattr(self.config.process_results, "batch", None)
+        if (batch is None and self.score_pool is None) or not self.instances:
+            return filtered
+
+        instances_by_doc_id = defaultdict(list)
+        for instance in self.instances:
+            instances_by_doc_id[instance.doc_id].append(instance)
+        items = []
+        for filter_key in self.instances[0].filtered_resps:
+            for _, instances in sorted(instances_by_doc_id.items()):
+                instances.sort(key=lambda x: x.idx)
+                items.append((instances[0].doc, [instance.filtered_resps[filter_key] for instance in instances]))
+
+        logger.info(f"Scoring {len(items)} responses of {self.config.task}")
+        if batch is not None and self.score_pool is not None:
+            metrics = self.score_pool.map_batches(self.config.process_results, items)
+        elif batch is not None:
+            docs, results = zip(*items, strict=True)
+            metrics = batch(list(docs), list(results))
+        else:
+            metrics = self.score_pool.map(self.config.process_results, items)
+
+        stats = Counter()
+        for doc_metrics in metrics:
+            stats.update(doc_metrics.pop(SCORING_STATS_KEY, {}))
+        if total := sum(stats.values()):
+            counts = ", ".join(f"{name} {count / total:.1%}" for name, count in stats.items())
+            logger.info(f"Scoring stats of {self.config.task} over {total}: {counts}")
+        self._scored = deque(zip(items, metrics, strict=True))
+        return filtered
+
+    def process_results(self, doc, results):
+        if self._scored:
+            (scored_doc, scored_results), metrics = self._scored.popleft()
+            if scored_doc == doc and scored_results == results:
+                return metrics
+            logger.warning(f"Documents of {self.config.task} scored out of order, scoring the rest serially")
+            self._scored = None
+
+        return super().process_results(doc, results)
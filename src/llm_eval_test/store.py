@@ -0,0 +1,100 @@
+import json
+import logging
+import os
+import re
+import uuid
+
+import datasets
+import pyarrow as pa
+from filelock import FileLock
+
+from llm_eval_test.manifest import repo_lock
+
+logger = logging.getLogger("llm-eval-test")
+
+STORE_DIR = "packed"
+INDEX_FILE = "index.json"
+
+
+class ArrowStore:
+    """Datasets packed into memory-mappable Arrow IPC files with a table index.
+
+    Each split of a (dataset_path, dataset_name) pair is one table. Loading maps the
+    files into memory rather than reading them, so tasks sharing a store share pages.
+    """
+
+    def __init__(self, datasets_dir: str):
+        self.datasets_dir = datasets_dir
+        self.store_dir = os.path.join(datasets_dir, STORE_DIR)
+        self.index_path = os.path.join(self.store_dir, INDEX_FILE)
+        self.tables: dict[str, dict] = {}
+        # Files of replaced packs, removed once the index no longer points at them
+        self._stale: list[str] = []
+        self.reload()
+
+    def reload(self):
+        """Read the index written by the last save, from this or another process."""
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.tables = json.load(f)["tables"]
+
+    def lock(self) -> FileLock:
+        """Inter-process lock to hold from reload() until save() when changing the store."""
+        # Kept out of the store so the manifest records only its data
+        return repo_lock(self.datasets_dir, STORE_DIR)
+
+    @staticmethod
+    def key(dataset_path: str, dataset_name: str | None) -> str:
+        return f"{dataset_path}:{dataset_name or ''}"
+
+    def has(self, dataset_path: str, dataset_name: str | None) -> bool:
+        return self.key(dataset_path, dataset_name) in self.tables
+
+    def add(self, dataset_path: str, dataset_name: str | None, dataset: datasets.DatasetDict):
+        """Write every split of a dataset to the store."""
+        os.makedirs(self.store_dir, exist_ok=True)
+        key = self.key(dataset_path, dataset_name)
+        # A new file name per pack, so running processes keep their mapped files and
+        # fingerprints (derived from the file path) change when the content does
+        prefix = re.sub(r"[^\w.-]+", "_", key) + f"-{uuid.uuid4().hex[:8]}"
+
+        splits = {}
+        for split, split_dataset in dataset.items():
+            filename = f"{prefix}-{split}.arrow"
+            if split_dataset._indices is not None:
+                split_dataset = split_dataset.flatten_indices()
+            table = split_dataset.data.table
+            # The stream format is what datasets memory-maps; features travel in the schema metadata
+            with pa.OSFile(os.path.join(self.store_dir, filename), "wb") as sink:
+                with pa.ipc.new_stream(sink, table.schema) as writer:
+                    writer.write_table(table)
+            splits[split] = {"file": filename, "rows": table.num_rows}
+
+        old_splits = self.tables.get(key, {}).get("splits", {})
+        self.tables[key] = {"path": dataset_path, "name": dataset_name, "splits": splits}
+        self._stale.extend(entry["file"] for entry in old_splits.values())
+
+    def load(self, dataset_path: str, dataset_name: str | None, splits: tuple[str, ...] = ()) -> datasets.DatasetDict:
+        """Load a packed dataset, or only the given splits of it, without copying it into memory."""
+        tables = self.tables[self.key(dataset_path, dataset_name)]["splits"]
+        return datasets.DatasetDict(
+            {
+                split: datasets.Dataset.from_file(os.path.join(self.store_dir, entry["file"]), in_memory=False)
+                for split, entry in tables.items()
+                if not splits or split in splits
+            }
+        )
+
+    def save(self):
+        # Write then rename so readers never see a partial index
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"tables": self.tables}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.index_path)
+
+        for filename in self._stale:
+            try:
+                os.remove(os.path.join(self.store_dir, filename))
+            except FileNotFoundError:
+                pass
+        self._stale.clear()